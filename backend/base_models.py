@@ -1,7 +1,9 @@
+from collections import defaultdict
 from django.apps import apps
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.query import ModelIterable
 
 """
 Rules:
@@ -59,6 +61,55 @@ class BaseModel(models.Model, metaclass=BaseModelMetaValidator):
                                     related_name="%(class)s_updated_by")
     objects = BaseModelManager()
 
+class PrimaryObjectQuerySet(models.QuerySet):
+    def tagged_items(self):
+        TaggedItem = apps.get_model('tags', 'TaggedItem')
+        return TaggedItem.objects.filter(model=ContentType.objects.get_for_model(self.model)).order_by()
+
+    def tagged(self, tags, match_all=True):
+        """
+        Filters to the objects tagged with all of the tags (by slug), or with any of them.
+        The tagged items are matched in one subquery on (model, instance_slug), whatever the number of tags.
+        """
+        tags = set(tags)
+        if not tags:
+            return self
+        tagged_items = self.tagged_items().filter(tag__in=tags)
+        if match_all and len(tags) > 1:
+            tagged_items = (
+                tagged_items.values('instance_slug')
+                .annotate(tag_count=models.Count('tag', distinct=True))
+                .filter(tag_count=len(tags))
+            )
+        return self.filter(pk__in=tagged_items.values('instance_slug'))
+
+    def tag_facets(self):
+        """
+        Returns [{'tag', 'name', 'count'}] for each visible tag of the objects in the queryset, most used first,
+        counted in one grouped query.
+        """
+        facets = (
+            self.tagged_items()
+            .filter(instance_slug__in=self.order_by().values('pk'), tag__hidden=False)
+            .values_list('tag', 'tag__name')
+            .annotate(count=models.Count('instance_slug'))
+            .order_by('-count', 'tag__name')
+        )
+        return [{'tag': tag, 'name': name, 'count': count} for tag, name, count in facets]
+
+    def with_tags(self):
+        """
+        Prefetches the tagged items of every object, with their tags, in one query,
+        so that tag_list costs nothing more per object.
+        """
+        TaggedItem = apps.get_model('tags', 'TaggedItem')
+        return self.prefetch_related(
+            models.Prefetch('taggeditems', queryset=TaggedItem.objects.select_related('tag').only('model', 'instance_slug', 'tag__name'))
+        )
+
+class PrimaryObjectModelManager(BaseModelManager.from_queryset(PrimaryObjectQuerySet)):
+    pass
+
 class PrimaryObjectModel(BaseModel):
     """
     Differs from the BaseModel mainly in the sense that it gathers all SecondaryObjectModels to it
@@ -76,6 +127,13 @@ class PrimaryObjectModel(BaseModel):
         verbose_name_plural = ""  # Must be defined
         default_related_name = ""  # Must be defined (verbose_name_plural.replace(" ", ""))
 
+    # Joined on the primary key, so this only finds the tagged items of models whose primary key is their slug
+    taggeditems = GenericRelation(
+        'tags.TaggedItem', content_type_field='model', object_id_field='instance_slug', related_query_name='%(class)s'
+    )
+
+    objects = PrimaryObjectModelManager()
+
     @property
     def tag_list(self):
         if not hasattr(self, '_tag_list'):
@@ -84,9 +142,55 @@ class PrimaryObjectModel(BaseModel):
 
 
 class SecondaryObjectQuerysetMixin(object):
+    """
+    Queryset methods for SecondaryObjectModels.
+    """
+    _prefetch_content_objects = False
+
+    def prefetch_content_objects(self):
+        """
+        When the queryset is evaluated, fetches the content objects of all of its rows with one
+        query per ContentType, rather than one per row, and attaches them as content_object_instance.
+        """
+        clone = self._chain()
+        clone._prefetch_content_objects = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._prefetch_content_objects = self._prefetch_content_objects
+        return clone
+
+    def _fetch_all(self):
+        fetching = self._result_cache is None
+        super()._fetch_all()
+        if fetching and self._prefetch_content_objects and self._iterable_class is ModelIterable:
+            self.attach_content_objects(self._result_cache)
+
+    def attach_content_objects(self, objects):
+        """
+        Sets content_object_instance on each of the objects, to None where the instance no longer exists.
+        """
+        slugs = defaultdict(set)
+        for obj in objects:
+            slugs[obj.model_id].add(obj.instance_slug)
+        instances = {}
+        for content_type_id, instance_slugs in slugs.items():
+            # ContentTypes are cached, so these are only queried once per process
+            model_class = ContentType.objects.db_manager(self.db).get_for_id(content_type_id).model_class()
+            instances[content_type_id] = {
+                instance.slug: instance
+                for instance in model_class._base_manager.using(self.db).filter(slug__in=instance_slugs)
+            }
+        content_object = self.model._meta.get_field('content_object')
+        for obj in objects:
+            obj._content_object_instance = instances[obj.model_id].get(obj.instance_slug)
+            content_object.set_cached_value(obj, obj._content_object_instance)  # None is cached too, and not fetched again
+
+class SecondaryObjectQuerySet(SecondaryObjectQuerysetMixin, models.QuerySet):
     pass
 
-class SecondaryObjectModelManager(models.Manager):
+class SecondaryObjectModelManager(BaseModelManager.from_queryset(SecondaryObjectQuerySet)):
     pass
 
 class SecondaryObjectModel(BaseModel):
@@ -112,13 +216,15 @@ class SecondaryObjectModel(BaseModel):
     # Slug
     slug = models.SlugField(max_length=200, primary_key=True, editable=False, unique=True)
 
+    objects = SecondaryObjectModelManager()
+
     @property
     def content_object_instance(self):
         """
-        Returns the object instance indicated by the model and instance_slug
+        Returns the object instance indicated by the model and instance_slug, or None if it no longer exists.
+        Use prefetch_content_objects() to fetch these for a whole queryset at once.
         """
-        if hasattr(self.model, '_content_object_instance'):
-            self._content_object_instance = self.model.get_object_for_this_type(slug=self.instance_slug)
-            return self._content_object_instance
-        else:
-            raise AttributeError(f"Model {self.model} has no attribute 'get_object_for_this_type,' it must be defined.")
\ No newline at end of file
+        if not hasattr(self, '_content_object_instance'):
+            model_class = ContentType.objects.db_manager(self._state.db).get_for_id(self.model_id).model_class()
+            self._content_object_instance = model_class._base_manager.using(self._state.db).filter(slug=self.instance_slug).first()
+        return self._content_object_instance
\ No newline at end of file
@@ -10,7 +10,7 @@ from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db.models import QuerySet
 from django.db.models.deletion import ProtectedError, RestrictedError
 from django.forms.models import model_to_dict
-from django.http import QueryDict, JsonResponse, Http404
+from django.http import QueryDict, JsonResponse, Http404, HttpResponseRedirect
 from django.template.loader import render_to_string
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
@@ -23,6 +23,8 @@ from rest_framework.status import HTTP_500_INTERNAL_SERVER_ERROR, HTTP_200_OK
 from rest_framework.views import APIView
 
 from backend.base_forms import CSVUploadForm, ImageUploadForm
+from backend.pagination import CursorPaginator, InvalidCursor
+from backend.utils import get_approximate_count
 
 ###
 logger = logging.getLogger('django')
@@ -133,6 +135,7 @@ class BaseModelView(BaseView):
     model = None
     context_object_name = None
     related_fields = None
+    cursor_pagination = False  # Page by cursor rather than by number (see CursorPaginator); clients may also ask with ?cursor=
 
     def get_order_by(self):
         """
@@ -143,12 +146,24 @@ class BaseModelView(BaseView):
         
         if 'order_by' in self.querydict:
             try:
-                return [self.querydict.pop('order_by')]
+                order_by = self.querydict.pop('order_by')  # A QueryDict pops every value as a list
+                return order_by if isinstance(order_by, list) else [order_by]
             except AttributeError:
                 return self.model._meta.ordering
         else:
             return self.model._meta.ordering
-            
+
+    def get_cursor(self):
+        """
+        Takes the cursor of the requested page out of the querydict.
+        Returns None when paging by number, and '' for the first page when paging by cursor.
+        """
+        cursor = self.querydict.get('cursor')
+        if 'cursor' in self.querydict:
+            self.querydict.pop('cursor')
+            return cursor or ''
+        return '' if self.cursor_pagination else None
+
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -199,7 +214,12 @@ class BaseModelAPI(APIView, BaseModelView):
         # Order
         self.order_by = self.get_order_by()
         # Page
-        self.page = int(self.querydict.pop('page', 1))
+        self.page = int(self.querydict.get('page', 1))
+        self.querydict.pop('page', None)
+        self.cursor = self.get_cursor()
+        # Count
+        self.count = self.querydict.get('count')
+        self.querydict.pop('count', None)
         return self.querydict
 
     def get_queryset(self):
@@ -226,32 +246,65 @@ class BaseModelAPI(APIView, BaseModelView):
                 pass
             return page_obj
 
+    def count_objects(self, objects):
+        """
+        Counts the objects with COUNT(*) when the client asks with ?count=exact, and otherwise
+        estimates the count from the query plan (see get_approximate_count).
+        """
+        if self.count == 'exact':
+            return objects.count()
+        return get_approximate_count(objects)
+
+    def get_cursor_page(self, objects):
+        """
+        Responds with the page of objects after self.cursor, and the cursor of the next page, which is None on the last page.
+        Pages are only counted when the client asks with ?count, so any number of objects can be paged through.
+        """
+        try:
+            page = CursorPaginator(objects, self.order_by, self.per_page).page(self.cursor)
+        except InvalidCursor as e:
+            return Response({"message": str(e), 'results': [], 'count': 0}, status=status.HTTP_400_BAD_REQUEST)
+        if not page.object_list:
+            return Response({"message": 'No results', 'results': [], 'count': 0, 'next': None}, status=status.HTTP_404_NOT_FOUND)
+        results = self.serializer_class(page.object_list, many=True).data
+        return Response(
+            {"message": 'Success', 'results': results, 'count': self.count_objects(objects) if self.count else None, 'next': page.next_cursor},
+            status=status.HTTP_200_OK
+        )
+
     def get(self, request, *args, **kwargs):
         """
         GET     list        api/{app}/{model}/                get all of {model}
         GET     instance    api/{app}/{model}/{identifier}    get instance by {identifier}
         GET     query       api/{app}/{model}/?**{query}       get subset by query
+        GET     page        api/{app}/{model}/?cursor={cursor} get the page after {cursor}
+
+        'count' is the number of objects on the last page, where it is known without counting, and
+        otherwise an estimate, or an exact count with ?count=exact (see count_objects).
+        'next' is the number of the next page, or None on the last page. Pages that start past
+        MAX_QUERYSET_SIZE objects are refused with a 400, as they can only be read by cursor.
         """
         self.get_querydict()
         objects = self.get_queryset()
-        count = objects.count()
-        # Nature of Response is determined by count of objects
-        if count > settings.MAX_QUERYSET_SIZE:
-            logger.warning("Too many objects found")
-            return Response({"message": 'Too many objects found, please submit a more specific query', 'results': [], 'count': 0}, status=status.HTTP_204_NO_CONTENT)
-        elif count > 1:
-            objects = objects.order_by(*self.order_by)
-            page = self.paginate_objects(objects, self.page)
-            if page:
-                objects = self.serializer_class(page.object_list, many=True).data
-                return Response({"message": 'Success', 'results': objects, 'count': count}, status=status.HTTP_200_OK)
-            else: # Requested page may be out of range.
-                return Response({"message": 'No results', 'results': [], 'count': 0}, status=status.HTTP_404_NOT_FOUND)
-        elif count == 1:
-            object = self.serializer_class(objects, many=True).data
-            return Response({"message": 'Success', 'results': object, 'count': count}, status=status.HTTP_200_OK)
-        elif count == 0:
-            return Response({"message": 'No results', 'results': [], 'count': count}, status=status.HTTP_404_NOT_FOUND)
+        if self.cursor is not None:
+            return self.get_cursor_page(objects)
+        offset = (max(self.page, 1) - 1) * self.per_page
+        if offset >= settings.MAX_QUERYSET_SIZE:
+            logger.warning("Page too deep")
+            message = f'Pages past the first {settings.MAX_QUERYSET_SIZE} objects can only be read by cursor, please page by cursor or submit a more specific query'
+            return Response({"message": message, 'results': [], 'count': 0}, status=status.HTTP_400_BAD_REQUEST)
+        # One more than a page shows whether there is a next page without counting
+        page = list(objects.order_by(*self.order_by)[offset:offset + self.per_page + 1])
+        has_next = len(page) > self.per_page
+        page = page[:self.per_page]
+        if not page: # Requested page may be out of range.
+            return Response({"message": 'No results', 'results': [], 'count': 0}, status=status.HTTP_404_NOT_FOUND)
+        count = self.count_objects(objects) if has_next else offset + len(page)
+        results = self.serializer_class(page, many=True).data
+        return Response(
+            {"message": 'Success', 'results': results, 'count': count, 'next': self.page + 1 if has_next else None},
+            status=status.HTTP_200_OK
+        )
 
     def post(self, request, *args, **kwargs):
         """
@@ -540,7 +593,9 @@ class BaseModelListView(BaseModelView, ListView):
         # Order
         self.order_by = self.get_order_by()
         # Page
-        self.page = int(self.querydict.pop('page', 1))
+        self.page = int(self.querydict.get('page', 1))
+        self.querydict.pop('page', None)
+        self.cursor = self.get_cursor()
         return self.querydict
 
     def get_queryset(self):
@@ -570,7 +625,36 @@ class BaseModelListView(BaseModelView, ListView):
             queryset = queryset.order_by(*ordering)
         return queryset
 
+    def get_cursor_context_data(self, **kwargs):
+        """
+        The context for a page of objects by cursor: the page is page_obj and object_list, and
+        next_cursor, if not None, is the cursor of the next page.
+        """
+        self.object_list = self.get_queryset()
+        context = super().get_context_data(**kwargs)
+        if any(list(self.querydict.values())):
+            context['querydict'] = self.querydict
+            context['url_querydict'] = urlencode(self.querydict)
+        try:
+            page = CursorPaginator(self.object_list, self.get_ordering(), self.per_page).page(self.cursor)
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        self.object_list = page.object_list
+        context.update({
+            'object_list': page.object_list,
+            'page_obj': page,
+            'cursor': self.cursor,
+            'next_cursor': page.next_cursor,
+            'queryset_length': len(page.object_list),
+        })
+        context['table_path'] = getattr(
+            self, 'table_path', f"{self.model._meta.app_label}/{self.model._meta.default_related_name}/table.html"
+        )
+        return context
+
     def get_context_data(self, **kwargs):
+        if self.cursor is not None:
+            return self.get_cursor_context_data(**kwargs)
         # Data
         self.object_list = self.get_queryset()
         context = super().get_context_data(**kwargs)
@@ -651,6 +735,7 @@ class BaseModelCSVUploadView(BaseModelFormView):
     template_name = 'upload_csv.html'
     form_class = CSVUploadForm
     required_fields = None
+    file_extensions = ('.csv',)
 
     def get_form_kwargs(self):
         return {}
@@ -664,17 +749,29 @@ class BaseModelCSVUploadView(BaseModelFormView):
         return context
 
     def process_csv(self):
+        """
+        Processes the uploaded file, self.file. May return a response to send instead of redirecting to the success url.
+        """
         raise NotImplementedError('method \'process_csv\' has no default behavior and must be defined')
 
+    def post(self, request, *args, **kwargs):
+        self.get_querydict()
+        form = self.form_class(request.POST, request.FILES)
+        if form.is_valid():
+            return self.form_valid(form)
+        return self.form_invalid(form)
+
     def form_valid(self, form):
-        file = form.cleaned_data['file']
-        if not file.name.endswith('.csv'):
+        self.file = form.cleaned_data['file']
+        if not self.file.name.lower().endswith(self.file_extensions):
             return self.form_invalid(form)
         try:
-            self.process_csv()
+            response = self.process_csv()
         except Exception as e:
+            logger.error(f"[{self.__class__.__name__}] Could not process {self.file.name}: {e}")
             return self.form_invalid(form)
-        return super().form_valid(form)
+        # Not BaseModelFormView.form_valid, as there is no model form to save
+        return response or HttpResponseRedirect(self.get_success_url())
 
     def form_invalid(self, form):
         return super().form_invalid(form)
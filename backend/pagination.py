@@ -0,0 +1,101 @@
+import json
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorSerializer:
+    """
+    Like signing.JSONSerializer, but cursors may hold dates, times, decimals and UUIDs.
+    """
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"), cls=DjangoJSONEncoder).encode("latin-1")
+
+    def loads(self, data):
+        return json.loads(data.decode("latin-1"))
+
+
+class CursorPage:
+    def __init__(self, object_list, cursor, next_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+
+class CursorPaginator:
+    """
+    Keyset pagination: rather than skipping the objects of earlier pages with OFFSET, each page
+    starts after the ordering keys of the last object of the page before, so deep pages cost the
+    same as the first when the keys are indexed.
+
+    The ordering is made unique by ending it with the primary key. Cursors are signed, so they are
+    opaque to clients and only valid for the ordering they were made for. Ordering keys must not
+    be null, and pages can only be followed forwards.
+    """
+    salt = "backend.pagination.CursorPaginator"
+
+    def __init__(self, queryset, ordering, per_page):
+        self.per_page = per_page
+        self.ordering = self.get_unique_ordering(queryset.model, ordering)
+        self.keys = [(f"_cursor_{position}", field.lstrip("-"), field.startswith("-")) for position, field in enumerate(self.ordering)]
+        self.queryset = queryset.annotate(**{alias: F(name) for alias, name, descending in self.keys}).order_by(*self.ordering)
+
+    def get_unique_ordering(self, model, ordering):
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = [field for field in ordering or () if isinstance(field, str) and field.lstrip("-")]
+        pk_name = model._meta.pk.name
+        if not any(field.lstrip("-") in ("pk", pk_name) for field in ordering):
+            ordering.append(pk_name)
+        return ordering
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, alias) for alias, name, descending in self.keys]
+        return signing.dumps({"ordering": self.ordering, "values": values}, salt=self.salt, serializer=CursorSerializer, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=self.salt, serializer=CursorSerializer)
+        except (signing.BadSignature, ValueError) as e:
+            raise InvalidCursor("Invalid cursor") from e
+        if data.get("ordering") != self.ordering or len(data.get("values", ())) != len(self.keys):
+            raise InvalidCursor("The cursor was made for a different ordering")
+        return data["values"]
+
+    def seek(self, values):
+        """
+        Returns the objects after those with the given ordering keys. The first key is also
+        bounded on its own, so that the database can start an index scan there.
+        """
+        after = Q()
+        for position, (alias, name, descending) in enumerate(self.keys):
+            equal = {earlier_name: values[earlier] for earlier, (earlier_alias, earlier_name, earlier_descending) in enumerate(self.keys[:position])}
+            after |= Q(**equal, **{f"{name}__{'lt' if descending else 'gt'}": values[position]})
+        first_alias, first_name, first_descending = self.keys[0]
+        start = Q(**{f"{first_name}__{'lte' if first_descending else 'gte'}": values[0]})
+        return self.queryset.filter(start & after)
+
+    def page(self, cursor=None):
+        """
+        Returns the page after the cursor, or the first page. Raises InvalidCursor for a cursor
+        that this paginator did not make.
+        """
+        queryset = self.seek(self.decode_cursor(cursor)) if cursor else self.queryset
+        # One more than a page shows whether there is another page without counting
+        objects = list(queryset[:self.per_page + 1])
+        next_cursor = self.encode_cursor(objects[self.per_page - 1]) if len(objects) > self.per_page else None
+        return CursorPage(objects[:self.per_page], cursor, next_cursor)
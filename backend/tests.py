@@ -0,0 +1,177 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils.text import slugify
+from rest_framework.test import APIRequestFactory, force_authenticate
+from entries.models import Entry
+from entries.views import EntryBase
+from tags.models import Tag, TaggedItem
+from users.models import BaseUser
+
+from .base_views import BaseModelAPI
+from .pagination import CursorPaginator, InvalidCursor
+from .utils import get_approximate_count
+
+
+class EntryPages(EntryBase, BaseModelAPI):
+    per_page = 2
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class BaseModelTestCase(TestCase):
+    """
+    Entries to page through, created by a test user.
+    Titles repeat, so that orderings by title are only made unique by the primary key.
+    """
+    titles = [("kafka-c", "Kafka"), ("redis", "Redis"), ("kafka-a", "Kafka"), ("flink", "Flink"), ("kafka-b", "Kafka")]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = BaseUser.objects.create_user(email="tester@example.com", username="tester", password="password")
+        for slug, title in cls.titles:
+            Entry.objects.create(slug=slug, title=title, description="<p>A test entry.</p>", created_by=cls.user, updated_by=cls.user)
+
+    def get(self, view=EntryPages, **params):
+        request = APIRequestFactory().get("/", params)
+        request.session = {}
+        force_authenticate(request, self.user)
+        return view.as_view()(request)
+
+
+class CursorPaginatorTests(BaseModelTestCase):
+    def pages(self, ordering, per_page=2):
+        paginator = CursorPaginator(Entry.objects.all(), ordering, per_page)
+        pages = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(1):
+                page = paginator.page(cursor)
+                pages.append([entry.slug for entry in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_in_a_stable_order(self):
+        # Ties are broken by the primary key, ascending unless it is in the ordering
+        self.assertEqual(self.pages("title"), [["flink", "kafka-a"], ["kafka-b", "kafka-c"], ["redis"]])
+        self.assertEqual(self.pages(["-title"], per_page=3), [["redis", "kafka-a", "kafka-b"], ["kafka-c", "flink"]])
+        self.assertEqual(self.pages(["title", "-slug"], per_page=5), [["flink", "kafka-c", "kafka-b", "kafka-a", "redis"]])
+
+    def test_new_objects_do_not_shift_pages(self):
+        paginator = CursorPaginator(Entry.objects.all(), "title", 2)
+        first = paginator.page()
+        Entry.objects.create(slug="apache", title="Apache", description="", created_by=self.user, updated_by=self.user)
+        self.assertEqual([entry.slug for entry in paginator.page(first.next_cursor)], ["kafka-b", "kafka-c"])
+
+    def test_invalid_cursors(self):
+        paginator = CursorPaginator(Entry.objects.all(), "title", 2)
+        cursor = paginator.page().next_cursor
+        with self.assertRaises(InvalidCursor):
+            paginator.page(cursor + "x")
+        with self.assertRaises(InvalidCursor):
+            paginator.page("not a cursor")
+        with self.assertRaises(InvalidCursor):
+            CursorPaginator(Entry.objects.all(), "-title", 2).page(cursor)
+
+
+class CursorPageAPITests(BaseModelTestCase):
+    def test_pages_by_cursor(self):
+        response = self.get(cursor="", order_by="title")
+        self.assertEqual([entry["slug"] for entry in response.data["results"]], ["flink", "kafka-a"])
+        self.assertIsNone(response.data["count"])
+        slugs = []
+        cursor = response.data["next"]
+        while cursor:
+            response = self.get(cursor=cursor, order_by="title")
+            self.assertEqual(response.status_code, 200)
+            slugs += [entry["slug"] for entry in response.data["results"]]
+            cursor = response.data["next"]
+        self.assertEqual(slugs, ["kafka-b", "kafka-c", "redis"])
+
+    def test_invalid_cursors(self):
+        cursor = self.get(cursor="", order_by="title").data["next"]
+        self.assertEqual(self.get(cursor="not a cursor").status_code, 400)
+        self.assertEqual(self.get(cursor=cursor, order_by="-title").status_code, 400)
+
+
+class BaseModelAPIPageTests(BaseModelTestCase):
+    def get(self, view=EntryPages, **params):
+        return super().get(view, order_by=["title", "slug"], **params)
+
+    def slugs(self, response):
+        return [entry["slug"] for entry in response.data["results"]]
+
+    def test_pages_are_counted(self):
+        with self.assertNumQueries(3):  # The page, the tags of its entries, and the count
+            response = self.get(page=1)
+        self.assertEqual(self.slugs(response), ["flink", "kafka-a"])
+        self.assertEqual(response.data["next"], 2)
+        self.assertIsInstance(response.data["count"], int)
+        if connection.vendor != "postgresql":  # The estimate is a count elsewhere
+            self.assertEqual(response.data["count"], 5)
+        response = self.get(page=2, count="exact")
+        self.assertEqual(self.slugs(response), ["kafka-b", "kafka-c"])
+        self.assertEqual((response.data["count"], response.data["next"]), (5, 3))
+
+    def test_last_page_is_counted_for_free(self):
+        with self.assertNumQueries(2):  # The page, and the tags of its entries
+            response = self.get(page=3)
+        self.assertEqual(self.slugs(response), ["redis"])
+        self.assertEqual((response.data["count"], response.data["next"]), (5, None))
+        self.assertEqual(self.get(page=4).status_code, 404)
+
+    def test_cursor_pages_are_counted_when_asked(self):
+        self.assertIsNone(self.get(cursor="").data["count"])
+        self.assertEqual(self.get(cursor="", count="exact").data["count"], 5)
+
+    @override_settings(MAX_QUERYSET_SIZE=4)
+    def test_deep_pages_are_refused(self):
+        self.assertEqual(self.get(page=2).status_code, 200)
+        response = self.get(page=3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cursor", response.data["message"])
+        self.assertEqual(self.get(cursor="").status_code, 200)
+
+    def test_approximate_count(self):
+        querysets = [Entry.objects.all(), Entry.objects.filter(title="Kafka"), Entry.objects.filter(title="Kafka")[:2]]
+        for queryset in querysets:
+            with self.subTest(query=str(queryset.query)):
+                count = get_approximate_count(queryset)
+                self.assertIsInstance(count, int)
+                if connection.vendor != "postgresql":  # Other databases are counted
+                    self.assertEqual(count, queryset.count())
+
+
+class PrefetchContentObjectsTests(BaseModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        content_type = ContentType.objects.get_for_model(Entry)
+        for name in ("Streaming", "Storage"):
+            tag = Tag.objects.create(
+                name=name, slug=slugify(name), model=ContentType.objects.get_for_model(Tag), instance_slug=slugify(name),
+                created_by=cls.user, updated_by=cls.user
+            )
+            for entry in Entry.objects.all():
+                TaggedItem.objects.create(
+                    tag=tag, model=content_type, instance_slug=entry.slug, tagged_by=cls.user, created_by=cls.user, updated_by=cls.user
+                )
+        TaggedItem.objects.filter(instance_slug="flink").update(instance_slug="deleted")
+
+    def test_one_query_per_content_type(self):
+        ContentType.objects.get_for_model(Entry)  # ContentTypes are cached once per process
+        with self.assertNumQueries(2):
+            tagged_items = list(TaggedItem.objects.prefetch_content_objects())
+            instances = {tagged_item.instance_slug: tagged_item.content_object_instance for tagged_item in tagged_items}
+            self.assertEqual(len(tagged_items), 10)
+            self.assertTrue(all(tagged_item.content_object == tagged_item.content_object_instance for tagged_item in tagged_items))
+        self.assertIsNone(instances["deleted"])
+        self.assertEqual(instances["redis"], Entry.objects.get(slug="redis"))
+
+    def test_only_when_asked(self):
+        with self.assertNumQueries(1):
+            tagged_items = list(TaggedItem.objects.prefetch_content_objects().values_list("instance_slug", flat=True))
+        self.assertEqual(len(tagged_items), 10)
+        tagged_item = TaggedItem.objects.get(tag="storage", instance_slug="redis")
+        with self.assertNumQueries(1):
+            self.assertEqual(tagged_item.content_object_instance.slug, "redis")
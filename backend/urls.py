@@ -19,6 +19,7 @@ from django.urls import path, include
 from rest_framework import routers
 from rest_framework_simplejwt.views import TokenObtainPairView
 from entries.urls import urlpatterns as entry_urlpatterns
+from tags.urls import urlpatterns as tag_urlpatterns
 from users.urls import urlpatterns as user_urlpatterns
 
 router = routers.DefaultRouter()
@@ -27,4 +28,4 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-] + entry_urlpatterns + user_urlpatterns
\ No newline at end of file
+] + entry_urlpatterns + tag_urlpatterns + user_urlpatterns
\ No newline at end of file
@@ -68,13 +68,43 @@ def get_parent_class_names(cls):
     except AttributeError:
         return [parent_class.__name__ for parent_class in cls.__bases__]
 
-def get_approximate_table_count(model):
-    from django.db import connection
-    table_name = model._meta.db_table
+def get_approximate_table_count(model, using='default'):
+    """
+    Returns the number of rows in the model's table as of PostgreSQL's last ANALYZE, which is far
+    cheaper than counting a large table. Tables that have never been analysed, and tables on other
+    databases, are counted.
+    """
+    from django.db import connections
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return int(row[0])
+    return model._default_manager.using(using).count()
+
+def get_approximate_count(queryset):
+    """
+    Returns an estimate of the number of objects in a queryset: the table count for an unfiltered
+    queryset, and otherwise the rows the PostgreSQL planner expects the query to return, from
+    EXPLAIN. Querysets on other databases are counted.
+    """
+    import json
+    from django.db import connections
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    query = queryset.query
+    if not query.where and not query.distinct and not query.is_sliced and not query.annotations:
+        return get_approximate_table_count(queryset.model, using=queryset.db)
+    sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
     with connection.cursor() as cursor:
-        cursor.execute(f"SELECT reltuples FROM pg_class WHERE relname = '{table_name}'")
-        approximate_count = cursor.fetchone()[0]
-    return approximate_count
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
 
 def read_static_file_from_gcs(filename):
     """
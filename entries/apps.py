@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_migrate
 
 
 class EntriesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'entries'
+
+    def ready(self):
+        from .signals import create_search_extensions, index_entry, remove_entry, remove_entry_title
+        pre_migrate.connect(create_search_extensions, sender=self)
+        Entry = self.get_model('Entry')
+        post_save.connect(index_entry, sender=Entry)
+        post_delete.connect(remove_entry, sender=Entry)
+        post_delete.connect(remove_entry_title, sender=Entry)
@@ -70,4 +70,8 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             raise TypeError(f"Unknown type for event: {type(event)}")
         if event['message_type'] not in ['success', 'info', 'warning', 'error']:
             raise ValueError(f"Unknown event type: {event['message_type']}")
-        await self.send(text_data=json.dumps(event))
\ No newline at end of file
+        await self.send(text_data=json.dumps(event))
+
+    async def entry_stream(self, event):
+        # Partial content of an entry being generated (see notifications.EntryStream)
+        await self.send(text_data=json.dumps(event))
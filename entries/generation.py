@@ -0,0 +1,155 @@
+import hashlib
+import json
+import random
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class GenerationBackend:
+    """
+    Generates the content of new entries. The backend in use is named by the ENTRY_GENERATION_BACKEND setting.
+    """
+    cacheable = True  # Whether responses are kept in the ENTRY_RESPONSE_CACHE
+    model_name = None  # Identifies the responses of this backend in the cache
+    system_prompt = ''
+
+    def generate(self, query, on_chunk=None):
+        """
+        Returns the content for the query. With on_chunk, it is called with each piece of the content as it is generated.
+        """
+        raise NotImplementedError('method \'generate\' has no default behavior and must be defined')
+
+
+class LocalGenerationBackend(GenerationBackend):
+    """
+    A stand-in for the model, for load testing and running the pipeline without an API key.
+    The content depends only on the query and the SIZE option, and follows the structure asked of
+    the model, mentioning other common topics so that there is something to link.
+    Options are read from the ENTRY_LOCAL_GENERATION setting:
+        SIZE: least length of the content in characters
+        LATENCY: seconds before the first piece of content
+        CHUNK_SIZE: characters in each streamed piece
+        CHUNK_INTERVAL: seconds between pieces; also spent, in total, on responses that are not streamed
+    """
+    cacheable = False
+    model_name = 'local'
+    defaults = {'SIZE': 4000, 'LATENCY': 0, 'CHUNK_SIZE': 20, 'CHUNK_INTERVAL': 0}
+    words = (
+        "system data request service client server protocol message queue stream cache index storage "
+        "network cluster node latency throughput schema query transaction replication partition api "
+        "deployment container runtime configuration library framework interface event state"
+    ).split()
+    topics = (
+        "kafka", "redis", "postgresql", "docker", "kubernetes", "python", "linux", "http", "json",
+        "graphql", "rabbitmq", "nginx", "elasticsearch", "terraform", "grpc", "webassembly",
+    )
+
+    @property
+    def options(self):
+        return {**self.defaults, **getattr(settings, 'ENTRY_LOCAL_GENERATION', {})}
+
+    def render(self, query):
+        generator = random.Random(hashlib.sha256(query.encode()).hexdigest())
+
+        def sentence():
+            words = [
+                generator.choice(self.topics) if generator.random() < 0.1 else generator.choice(self.words)
+                for _ in range(generator.randint(8, 24))
+            ]
+            words.insert(generator.randrange(len(words)), query)
+            return " ".join(words).capitalize() + "."
+
+        def paragraph():
+            return f"<p>{' '.join(sentence() for _ in range(generator.randint(3, 6)))}</p>"
+
+        size = self.options['SIZE']
+        parts = [
+            "<h3>Introduction</h3>", paragraph(),
+            "<h3>Key Terms and Concepts</h3>",
+            "<ul>" + "".join(f"<li><strong>{generator.choice(self.words).title()}</strong>: {sentence()}</li>" for _ in range(4)) + "</ul>",
+            "<h3>Explanation</h3>", paragraph(),
+        ]
+        ending = [
+            "<h3>Use Cases</h3>", paragraph(),
+            "<h3>See Also:</h3>", paragraph(),
+            "<h3>Further Reading / References</h3>",
+            "<ul><li><a _blank>Official documentation</a></li><li><a _blank>Tutorials</a></li></ul>",
+        ]
+        length = sum(len(part) + 1 for part in parts + ending)
+        while length < size:
+            parts.append(paragraph())
+            length += len(parts[-1]) + 1
+        return "\n".join(parts + ending)
+
+    def generate(self, query, on_chunk=None):
+        options = self.options
+        content = self.render(query)
+        chunk_size = max(options['CHUNK_SIZE'], 1)
+        chunks = [content[start:start + chunk_size] for start in range(0, len(content), chunk_size)]
+        time.sleep(options['LATENCY'])
+        if on_chunk is None:
+            time.sleep(options['CHUNK_INTERVAL'] * len(chunks))
+            return content
+        for chunk in chunks:
+            on_chunk(chunk)
+            time.sleep(options['CHUNK_INTERVAL'])
+        return content
+
+
+_backends = {}
+
+def get_generation_backend():
+    path = settings.ENTRY_GENERATION_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+def get_response_cache():
+    """
+    The cache that responses are kept in, named by the ENTRY_RESPONSE_CACHE setting.
+    Returns None if responses are not cached.
+    """
+    alias = getattr(settings, "ENTRY_RESPONSE_CACHE", None)
+    return caches[alias] if alias else None
+
+def response_cache_key(query, backend):
+    """
+    Responses are addressed by what produced them, so a change to the model or the
+    system prompt never serves a response generated under the old ones.
+    """
+    normalised_query = " ".join(query.lower().split())
+    payload = json.dumps([backend.model_name, backend.system_prompt, normalised_query])
+    return f"entries:response:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+def get_cached_response(query):
+    """
+    Returns the cached response for the query, or None.
+    """
+    backend = get_generation_backend()
+    response_cache = get_response_cache()
+    if response_cache is None or not backend.cacheable or not backend.model_name:
+        return None
+    return response_cache.get(response_cache_key(query, backend))
+
+def generate_entry(query, on_chunk=None):
+    """
+    Returns the content of a new entry for the query from the generation backend.
+    Responses are cached (see ENTRY_RESPONSE_CACHE), so the same query is only generated once.
+    With on_chunk, it is called with each piece of the content as it is generated; a cached
+    response is passed to it whole.
+    """
+    backend = get_generation_backend()
+    response_cache = get_response_cache() if backend.cacheable and backend.model_name else None
+    cache_key = response_cache_key(query, backend)
+    if response_cache is not None:
+        content = response_cache.get(cache_key)
+        if content is not None:
+            if on_chunk is not None:
+                on_chunk(content)
+            return content
+    content = backend.generate(query, on_chunk=on_chunk)
+    if response_cache is not None and content:
+        response_cache.set(cache_key, content)
+    return content
@@ -0,0 +1,205 @@
+import html
+import re
+import time
+from bs4 import BeautifulSoup, NavigableString
+from bs4.element import PreformattedString
+from django.conf import settings
+from django.core.cache import cache, caches
+from .utils import strip_html
+
+
+class EntryLinker:
+    """
+    Compiles a set of (title, slug) pairs into a single case-insensitive pattern
+    and uses it to turn mentions of those titles into links to their entries.
+
+    The pattern is generated from a character trie of the titles rather than a flat
+    alternation, so the cost of a scan depends on the length of the text and not on
+    the number of titles. Each document is parsed once and each of its text nodes is
+    visited once, whatever the size of the corpus.
+    """
+    skip_tags = ('a', 'script', 'style')  # Text inside these tags is never linked
+
+    def __init__(self, titles):
+        self.slugs = {}
+        for title, slug in titles:
+            key = self.normalise(title)
+            if key:
+                self.slugs.setdefault(key, slug)
+        self.pattern = self.compile(self.slugs) if self.slugs else None
+
+    def __len__(self):
+        return len(self.slugs)
+
+    @staticmethod
+    def normalise(title):
+        """
+        The form in which titles are compared: lowercase with collapsed whitespace.
+        """
+        return " ".join(title.lower().split())
+
+    @classmethod
+    def compile(cls, titles):
+        """
+        Builds the trie of the normalised titles and compiles it into one pattern.
+        Matches must not be preceded or followed by a word character. The trie is
+        greedy, so the longest title wins and shorter ones are only tried if the
+        longer title fails the boundary check.
+        """
+        trie = {}
+        for title in titles:
+            node = trie
+            for char in title:
+                node = node.setdefault(char, {})
+            node[''] = True
+        return re.compile(r'(?<!\w)' + cls._trie_pattern(trie) + r'(?!\w)', re.IGNORECASE)
+
+    @classmethod
+    def _trie_pattern(cls, node):
+        alternatives = [
+            (r'\s+' if char == ' ' else re.escape(char)) + cls._trie_pattern(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not alternatives:
+            return ''
+        pattern = alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+        if '' in node:
+            pattern = f"(?:{pattern})?"
+        return pattern
+
+    def mentions(self, html_content):
+        """
+        A cheap check on the raw document, used to avoid parsing documents that
+        cannot contain a link target.
+        """
+        return self.pattern is not None and bool(self.pattern.search(html.unescape(html_content)))
+
+    def _text_nodes(self, tag):
+        for child in tag.children:
+            if isinstance(child, NavigableString):
+                if not isinstance(child, PreformattedString):  # Comments, CDATA, doctypes
+                    yield child
+            elif child.name not in self.skip_tags:
+                yield from self._text_nodes(child)
+
+    def link(self, html_content, exclude=()):
+        """
+        Wraps every mention of a known title in the document with a link to its entry,
+        leaving text that is already inside a link untouched. Titles whose slug is in
+        `exclude` are not linked.
+        Returns the new document and a list of the (slug, anchor text) links added;
+        when nothing was linked the document is returned as it was given.
+        """
+        if not self.mentions(html_content):
+            return html_content, []
+
+        soup = BeautifulSoup(html_content, 'html.parser')
+        links = []
+        for text_node in list(self._text_nodes(soup)):
+            text = str(text_node)
+            nodes = []
+            position = 0
+            for match in self.pattern.finditer(text):
+                slug = self.slugs[self.normalise(match.group())]
+                if slug in exclude:
+                    continue
+                if match.start() > position:
+                    nodes.append(NavigableString(text[position:match.start()]))
+                anchor = soup.new_tag('a', href=f"/entries/{slug}")
+                anchor.string = match.group()
+                nodes.append(anchor)
+                links.append((slug, match.group()))
+                position = match.end()
+            if nodes:
+                if position < len(text):
+                    nodes.append(NavigableString(text[position:]))
+                text_node.replace_with(*nodes)
+
+        if not links:
+            return html_content, []
+        return str(soup), links
+
+
+LINK_PATTERN = re.compile(r"""<a\b[^>]*?\bhref=["']/entries/([\w\-]+)/?["'][^>]*>(.*?)</a>""", re.IGNORECASE | re.DOTALL)
+
+def extract_links(html_content):
+    """
+    Returns the (slug, anchor text) of every link to an entry in the document, in order of appearance.
+    """
+    return [(slug, " ".join(strip_html(text).split())) for slug, text in LINK_PATTERN.findall(html_content)]
+
+def unlink(html_content, slug=None):
+    """
+    Removes links to the given entry from the document, keeping their text.
+    Without a slug, links to every entry are removed.
+    Returns the document unchanged if it has no such links.
+    """
+    if f"/entries/{slug or ''}" not in html_content:
+        return html_content
+    soup = BeautifulSoup(html_content, 'html.parser')
+    target = re.escape(slug) if slug else r"[\w\-]+"
+    anchors = soup.find_all('a', href=re.compile(rf"^/entries/{target}/?$"))
+    if not anchors:
+        return html_content
+    for anchor in anchors:
+        anchor.unwrap()
+    return str(soup)
+
+
+CORPUS_VERSION_KEY = 'entries:corpus_version'
+_corpus_linker = (None, None)  # (corpus version, EntryLinker) for this process
+
+def get_corpus_version_cache():
+    """
+    The cache that the corpus version is kept in, named by the ENTRY_CORPUS_VERSION_CACHE setting.
+    """
+    return caches[settings.ENTRY_CORPUS_VERSION_CACHE]
+
+def get_corpus_version():
+    """
+    Returns the version of the set of entry titles, which changes whenever an entry
+    is created, renamed or deleted. It is kept in the ENTRY_CORPUS_VERSION_CACHE so that it is shared by all workers.
+    Returns None if that cache does not keep values (e.g. DummyCache), in which case
+    nothing keyed by the version should be reused.
+    """
+    version_cache = get_corpus_version_cache()
+    version = version_cache.get(CORPUS_VERSION_KEY)
+    if version is None:
+        # Started from the clock so that a lost version never reuses an older number
+        version_cache.add(CORPUS_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = version_cache.get(CORPUS_VERSION_KEY)
+    return version
+
+def bump_corpus_version():
+    try:
+        return get_corpus_version_cache().incr(CORPUS_VERSION_KEY)
+    except ValueError:  # Version not set yet
+        return get_corpus_version()
+
+def get_corpus_linker():
+    """
+    Returns an EntryLinker for every entry title, compiled once per process and corpus version.
+    """
+    global _corpus_linker
+    from .models import Entry
+    version = get_corpus_version()
+    linker_version, linker = _corpus_linker
+    if linker is None or version is None or linker_version != version:
+        linker = EntryLinker(Entry.objects.values_list('title', 'slug'))
+        _corpus_linker = (version, linker)
+    return linker
+
+def render_links(entry):
+    """
+    Returns the entry's description with links to other entries injected, for ENTRY_LINK_MODE 'render'.
+    The result is memoized per entry, entry revision and corpus version.
+    """
+    version = get_corpus_version()
+    revision = entry.date_updated.timestamp() if entry.date_updated else 0
+    key = f"entries:rendered:{entry.slug}:{revision}:{version}"
+    description = cache.get(key) if version is not None else None
+    if description is None:
+        description, _ = get_corpus_linker().link(entry.description, exclude=(entry.slug,))
+        if version is not None:
+            cache.set(key, description, timeout=settings.ENTRY_RENDER_CACHE_TIMEOUT)
+    return description
@@ -0,0 +1,49 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import slugify
+from entries.models import Entry
+from entries.tasks import queue_entry_batch
+from entries.utils import read_topics
+
+
+class Command(BaseCommand):
+    help = "Generates entries for a list of topics in a CSV file (with a 'topic' column) or a JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="A .csv or .jsonl file of topics")
+        parser.add_argument('--user', required=True, help="Email of the user the entries are created by")
+        parser.add_argument('--concurrency', type=int, default=None, help="Entries generated at once (default ENTRY_BATCH_CONCURRENCY)")
+        parser.add_argument('--no-wait', action='store_true', help="Queue the batch without waiting for it to finish")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] is not None and options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with the email {options['user']}")
+        try:
+            with open(options['path'], encoding='utf-8-sig') as file:
+                topics = read_topics(file, options['path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read topics: {e}")
+
+        result, batch = queue_entry_batch(topics, user, concurrency=options['concurrency'])
+        self.stdout.write(
+            f"Queued {len(batch['queued'])} topics; {len(batch['existing'])} already have entries "
+            f"and {len(batch['invalid'])} are invalid"
+        )
+        if result is None or options['no_wait']:
+            return
+
+        slugs = [slugify(query) for query in batch['queued']]
+        generated = -1
+        while not result.ready():
+            count = Entry.objects.filter(slug__in=slugs).count()
+            if count != generated:
+                generated = count
+                self.stdout.write(f"Generated {generated} of {len(slugs)} entries")
+            time.sleep(2)
+        totals = result.get()
+        self.stdout.write(self.style.SUCCESS(f"Generated {totals['created']} of {totals['entries']} entries and linked them"))
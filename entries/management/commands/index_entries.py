@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from entries.models import Entry, EntryLink, EntryTerm
+from entries.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the EntryTerm index, EntryLink graph and search index for every entry, e.g. after they are first introduced."
+
+    def handle(self, *args, **options):
+        entries = Entry.objects.only('slug', 'description').order_by('slug')
+        total = entries.count()
+        for count, entry in enumerate(entries.iterator(), start=1):
+            EntryTerm.objects.index_entry(entry)
+            EntryLink.objects.sync_entry(entry)
+            if count % 500 == 0 or count == total:
+                self.stdout.write(f"Indexed {count} of {total} entries")
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS("Entry term index, link graph and search index rebuilt"))
@@ -0,0 +1,37 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from entries.tasks import relink_corpus
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the links in every entry's description, e.g. after the linking rules have changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Entries per parallel relink task")
+        parser.add_argument('--no-wait', action='store_true', help="Queue the relink without waiting for it to finish")
+
+    def handle(self, *args, **options):
+        if settings.ENTRY_LINK_MODE != 'stored':
+            raise CommandError("Links are only stored in descriptions when ENTRY_LINK_MODE is 'stored'")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        result = relink_corpus(chunk_size=options['chunk_size'])
+        chunks = result.parent
+        # Run eagerly (CELERY_TASK_ALWAYS_EAGER), the chord has already finished and has no parent
+        if chunks is not None:
+            self.stdout.write(f"Queued {len(chunks)} relink chunks")
+            if options['no_wait']:
+                return
+
+            completed = -1
+            while not result.ready():
+                if chunks.completed_count() != completed:
+                    completed = chunks.completed_count()
+                    self.stdout.write(f"Relinked {completed} of {len(chunks)} chunks")
+                time.sleep(1)
+        totals = result.get()
+        self.stdout.write(self.style.SUCCESS(
+            f"Relinked {totals['entries']} entries: {totals['updated']} changed, {totals['links']} links"
+        ))
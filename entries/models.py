@@ -1,6 +1,12 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Count
 from django.utils.text import slugify
-from backend.base_models import PrimaryObjectModel
+from backend.base_models import BaseModelManager, PrimaryObjectModel, PrimaryObjectQuerySet
+from .linker import bump_corpus_version, extract_links
+from .utils import strip_html, tokenise
 """
 Rules:
     - ForeignKey/ManytoMany fields must have the same name as the model, regardless of plurality.
@@ -13,6 +19,27 @@ Rules:
     - All models should prefetch_related for related objects.
 """
 
+class EntryQuerySet(PrimaryObjectQuerySet):
+    """
+    Bumps the corpus version for changes to the set of titles made without Entry.save.
+    Deletes are covered by the post_delete signal (see entries.signals).
+    """
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            transaction.on_commit(bump_corpus_version, using=self.db)
+        return objs
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows and {'title', 'slug'} & set(kwargs):
+            transaction.on_commit(bump_corpus_version, using=self.db)
+        return rows
+
+class EntryManager(BaseModelManager.from_queryset(EntryQuerySet)):
+    pass
+
+
 class Entry(PrimaryObjectModel):
     class Meta:
         abstract = False
@@ -22,17 +49,173 @@ class Entry(PrimaryObjectModel):
         verbose_name_plural = 'entries'
         default_related_name = 'entries'
         ordering = ('title',)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='entries_search_vector_gin'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='entries_title_trgm_gin'),  # Needs pg_trgm (see signals)
+            models.Index(fields=['title', 'slug'], name='entries_title_slug'),  # The ordering keys, for paging by cursor
+        ]
 
     title = models.CharField(max_length=120)
     slug = models.CharField(max_length=120, primary_key=True)
 
     description = models.TextField()
+    link_pending = models.BooleanField(default=False, editable=False, db_index=True)  # Waiting for a linking pass
+    search_vector = SearchVectorField(null=True, editable=False)  # Maintained by PostgresSearchBackend
+
+    objects = EntryManager()
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Kept so that a rename can be detected on save
+        instance._loaded_title = instance.__dict__.get('title')
+        return instance
+
     def save(self, *args, **kwargs):
+        from .tasks import schedule_hyperlinks
         self.title = self.title.title()
         if not self.slug:
             self.slug = slugify(self.title)
-        return super().save()
+        adding = self._state.adding
+        loaded_title = getattr(self, '_loaded_title', None)
+        renamed = loaded_title is not None and loaded_title != self.title
+        super().save(*args, **kwargs)
+        self._loaded_title = self.title
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'description' in update_fields:
+            if settings.ENTRY_LINK_MODE == 'stored':
+                EntryTerm.objects.index_entry(self)
+            EntryLink.objects.sync_entry(self)
+        if adding or renamed:
+            transaction.on_commit(bump_corpus_version)
+        if renamed and settings.ENTRY_LINK_MODE == 'stored':
+            # Existing links still resolve by slug, but mentions of the new title need linking
+            schedule_hyperlinks(self.pk)
+
+    def delete(self, *args, **kwargs):
+        from .tasks import unlink_entry
+        slug = self.slug
+        source_slugs = list(self.backlinks.exclude(source=slug).values_list('source', flat=True))
+        deleted = super().delete(*args, **kwargs)
+        if source_slugs:
+            transaction.on_commit(lambda: unlink_entry.delay(slug, source_slugs))
+        return deleted
+
+
+class EntryTermManager(models.Manager):
+    def index_entry(self, entry):
+        """
+        Brings the terms indexed for an entry in line with its description,
+        only deleting and inserting the terms that have changed.
+        """
+        max_length = self.model._meta.get_field('term').max_length
+        terms = tokenise(strip_html(entry.description), max_length)
+        indexed = set(self.filter(entry=entry).values_list('term', flat=True))
+        with transaction.atomic():
+            if indexed - terms:
+                self.filter(entry=entry, term__in=indexed - terms).delete()
+            if terms - indexed:
+                self.bulk_create(
+                    [self.model(entry=entry, term=term) for term in terms - indexed],
+                    batch_size=1000, ignore_conflicts=True
+                )
+
+    def mentioning(self, title):
+        """
+        Returns the entries whose description contains every term of the title.
+        These are candidates only; the phrase itself must still be matched.
+        A title without any indexable terms cannot be narrowed down, so all entries are returned.
+        """
+        max_length = self.model._meta.get_field('term').max_length
+        terms = tokenise(title, max_length)
+        if not terms:
+            return Entry.objects.all()
+        entry_slugs = (
+            self.filter(term__in=terms)
+            .values('entry')
+            .annotate(matched=Count('term'))
+            .filter(matched=len(terms))
+            .values('entry')
+        )
+        return Entry.objects.filter(slug__in=entry_slugs)
+
+
+class EntryTerm(models.Model):
+    """
+    A reverse index of the normalised terms found in each entry's description.
+    It is used to find the few entries that may mention a title without reading every description.
+
+    The index is maintained by Entry.save. Adding links to a description does not change
+    its text, so the linker may write descriptions with update() or bulk_update() directly.
+    """
+    class Meta:
+        app_label = 'entries'
+        db_table = 'EntryTerm'
+        verbose_name = 'entry term'
+        verbose_name_plural = 'entry terms'
+        default_related_name = 'entryterms'
+        unique_together = (('term', 'entry'),)
+
+    term = models.CharField(max_length=50)
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE)
+
+    objects = EntryTermManager()
+
+    def __str__(self):
+        return f"{self.term} - {self.entry_id}"
+
+
+class EntryLinkManager(models.Manager):
+    def add_links(self, links):
+        """
+        Records links as they are added by the linker.
+        links is an iterable of (source slug, target slug, anchor text).
+        """
+        self.bulk_create(
+            [
+                self.model(source_id=source, target_id=target, anchor_text=anchor_text[:200])
+                for source, target, anchor_text in links
+            ],
+            batch_size=1000, ignore_conflicts=True
+        )
+
+    def sync_entry(self, entry):
+        """
+        Replaces the outbound links recorded for an entry with those found in its description.
+        Links to entries that do not exist are ignored.
+        """
+        links = {}
+        for target, anchor_text in extract_links(entry.description):
+            if target != entry.slug:
+                links.setdefault(target, anchor_text)
+        targets = set(Entry.objects.filter(slug__in=links.keys()).values_list('slug', flat=True)) if links else set()
+        with transaction.atomic():
+            self.filter(source=entry).delete()
+            self.add_links((entry.slug, target, links[target]) for target in targets)
+
+
+class EntryLink(models.Model):
+    """
+    A link from one entry's description to another entry.
+    This mirrors the links in the stored HTML so that backlinks and link counts
+    are an indexed lookup rather than a scan of every description.
+    """
+    class Meta:
+        app_label = 'entries'
+        db_table = 'EntryLink'
+        verbose_name = 'entry link'
+        verbose_name_plural = 'entry links'
+        default_related_name = 'entrylinks'
+        unique_together = (('source', 'target'),)
+
+    source = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name='outboundlinks', related_query_name='outboundlink')
+    target = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name='backlinks', related_query_name='backlink')
+    anchor_text = models.CharField(max_length=200)
+
+    objects = EntryLinkManager()
+
+    def __str__(self):
+        return f"{self.source_id} -> {self.target_id}"
@@ -0,0 +1,58 @@
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+
+def notify_user(user_slug, type_, message, **extra):
+    """
+    Sends a notification to every websocket the user has open (see NotificationConsumer).
+    """
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f"user_{user_slug}",
+        {
+            "type": "send_notification",
+            "message_type": type_,
+            "message": message,
+            **extra
+        }
+    )
+
+
+class EntryStream:
+    """
+    Forwards the content of an entry to the user's websockets as it is generated, as
+    `entry_stream` events. Pieces are buffered and sent at most once per ENTRY_STREAM_FRAME_INTERVAL,
+    so the rate of events does not depend on how finely the model splits its output.
+    Each event carries the content added since the previous one; the last has `done` set.
+    """
+    def __init__(self, user_slug, job_id):
+        self.group_name = f"user_{user_slug}"
+        self.job_id = job_id
+        self.channel_layer = get_channel_layer()
+        self.buffer = []
+        self.last_sent = 0
+
+    def __call__(self, chunk):
+        self.buffer.append(chunk)
+        if time.monotonic() - self.last_sent >= settings.ENTRY_STREAM_FRAME_INTERVAL:
+            self.flush()
+
+    def flush(self, done=False):
+        if not self.buffer and not done:
+            return
+        async_to_sync(self.channel_layer.group_send)(
+            self.group_name,
+            {
+                "type": "entry_stream",
+                "jobId": self.job_id,
+                "content": "".join(self.buffer),
+                "done": done,
+            }
+        )
+        self.buffer = []
+        self.last_sent = time.monotonic()
+
+    def close(self):
+        self.flush(done=True)
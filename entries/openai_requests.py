@@ -1,5 +1,10 @@
-from openai import OpenAI
+import random
+import threading
+import time
+from openai import APIConnectionError, APIStatusError, OpenAI
 from django.conf import settings
+from django.core.cache import cache
+from .generation import GenerationBackend
 
 system_prompt = """
 You are a technical knowledge expert tasked with generating comprehensive explanations for technologies, tools, standards, and technical concepts.
@@ -32,10 +37,157 @@ Structure your response as HTML using the following guide. Other sections may be
 </ul>
 """
 
-def request_new_entry(query: str) -> str:
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key: str) -> OpenAI:
+   """
+   Returns the process-wide client for the key and OPENAI_BASE_URL, so that its connection pool
+   (and the keep-alive connections and TLS sessions in it) is reused between requests.
+   Retries are left to request_new_entry, which shares its rate limits with other workers.
+   """
+   base_url = getattr(settings, "OPENAI_BASE_URL", None)
+   key = (api_key, base_url)
+   with _clients_lock:
+      if key not in _clients:
+         _clients[key] = OpenAI(api_key=api_key, base_url=base_url, timeout=settings.OPENAI_TIMEOUT, max_retries=0)
+      return _clients[key]
+
+
+class TokenBucketLimiter:
+   """
+   Token buckets kept in the default cache, so that every worker draws from the same allowance.
+   `rates` maps the name of each bucket to its capacity per minute; a bucket refills continuously
+   and holds at most a minute's worth. Changes to the buckets are serialised with a cache lock.
+   """
+   def __init__(self, name, rates):
+      self.key = f"openai:buckets:{name}"
+      self.rates = {bucket: rate for bucket, rate in rates.items() if rate}
+
+   def _lock(self):
+      deadline = time.monotonic() + 5
+      while not cache.add(f"{self.key}:lock", True, timeout=5):
+         if time.monotonic() > deadline:  # The holder died; its lock expires on its own
+            return False
+         time.sleep(0.01)
+      return True
+
+   def _unlock(self):
+      cache.delete(f"{self.key}:lock")
+
+   def _refill(self, levels, now):
+      for bucket, rate in self.rates.items():
+         level, updated = levels.get(bucket, (rate, now))
+         levels[bucket] = (min(rate, level + (now - updated) * rate / 60), now)
+      return levels
+
+   def try_acquire(self, amounts):
+      """
+      Takes the amounts from their buckets if all of them have enough.
+      Returns 0 if they were taken, or the seconds to wait until they will be.
+      """
+      if not self.rates:
+         return 0
+      locked = self._lock()
+      try:
+         now = time.time()
+         levels = self._refill(cache.get(self.key) or {}, now)
+         wait = 0
+         for bucket, rate in self.rates.items():
+            amount = min(amounts.get(bucket, 0), rate)  # A request larger than the bucket would wait forever
+            wait = max(wait, (amount - levels[bucket][0]) * 60 / rate)
+         if wait <= 0:
+            for bucket, rate in self.rates.items():
+               level, updated = levels[bucket]
+               levels[bucket] = (level - min(amounts.get(bucket, 0), rate), updated)
+            cache.set(self.key, levels, timeout=120)
+         return max(wait, 0)
+      finally:
+         if locked:
+            self._unlock()
+
+   def acquire(self, amounts):
+      """
+      Blocks until the amounts can be taken from their buckets.
+      """
+      while True:
+         wait = self.try_acquire(amounts)
+         if not wait:
+            return
+         time.sleep(wait + random.uniform(0, 0.1))  # Jittered so that waiting workers don't all retry at once
+
+   def adjust(self, amounts):
+      """
+      Corrects the buckets once the actual amounts used are known; negative amounts are refunded.
+      """
+      if not any(amounts.get(bucket) for bucket in self.rates):
+         return
+      locked = self._lock()
+      try:
+         levels = self._refill(cache.get(self.key) or {}, time.time())
+         for bucket, rate in self.rates.items():
+            level, updated = levels[bucket]
+            levels[bucket] = (min(rate, level - amounts.get(bucket, 0)), updated)
+         cache.set(self.key, levels, timeout=120)
+      finally:
+         if locked:
+            self._unlock()
+
+
+def get_limiter(model_name: str) -> TokenBucketLimiter:
+   return TokenBucketLimiter(model_name, {
+      "requests": settings.OPENAI_REQUESTS_PER_MINUTE,
+      "tokens": settings.OPENAI_TOKENS_PER_MINUTE,
+   })
+
+def estimate_tokens(query: str) -> int:
+   """
+   A rough count of the tokens a request will use, taken from the limiter before it is sent
+   and corrected once the response reports its usage.
+   """
+   return (len(system_prompt) + len(query)) // 4 + settings.OPENAI_ESTIMATED_COMPLETION_TOKENS
+
+def backoff_delay(attempt: int, error=None) -> float:
+   """
+   Full-jitter exponential backoff, or the wait the provider asked for in Retry-After.
+   """
+   response = getattr(error, "response", None)
+   retry_after = response.headers.get("retry-after") if response is not None else None
+   if retry_after:
+      try:
+         return float(retry_after)
+      except ValueError:
+         pass
+   return random.uniform(0, min(settings.OPENAI_BACKOFF_MAX, settings.OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+def is_retryable(error) -> bool:
+   if isinstance(error, APIConnectionError):  # Includes timeouts
+      return True
+   return isinstance(error, APIStatusError) and (error.status_code in (408, 409, 429) or error.status_code >= 500)
+
+def create_completion(client, limiter, model_name, messages, tokens, **kwargs):
+   """
+   Sends the request once the limiter allows it, retrying with backoff on rate limits,
+   server errors and dropped connections.
+   """
+   for attempt in range(settings.OPENAI_MAX_RETRIES + 1):
+      limiter.acquire({"requests": 1, "tokens": tokens})
+      try:
+         return client.chat.completions.create(model=model_name, messages=messages, **kwargs)
+      except Exception as e:
+         limiter.adjust({"tokens": -tokens})  # Nothing was generated
+         if attempt == settings.OPENAI_MAX_RETRIES or not is_retryable(e):
+            raise
+         time.sleep(backoff_delay(attempt, e))
+
+def request_new_entry(query: str, on_chunk=None) -> str:
    """
    Query the OpenAI API with a system prompt and a user input message.
    The model name is retrieved from Django settings (OPENAI_MODEL_NAME).
+   Requests are held to OPENAI_REQUESTS_PER_MINUTE and OPENAI_TOKENS_PER_MINUTE across all
+   workers, and retried with backoff when the provider is rate limiting or unavailable.
+   With on_chunk, the response is streamed and on_chunk is called with each piece of content
+   as it arrives. The full content is still returned.
    """
    api_key = settings.OPENAI_API_KEY
    if not api_key:
@@ -45,12 +197,45 @@ def request_new_entry(query: str) -> str:
    if not model_name:
       raise RuntimeError("OPENAI_MODEL_NAME not configured in Django settings.")
 
-   client = OpenAI(api_key=api_key)
-   response = client.chat.completions.create(
-      model=model_name,
-      messages=[
-         {"role": "system", "content": system_prompt},
-         {"role": "user", "content": query}
-      ]
-   )
-   return response.choices[0].message.content
\ No newline at end of file
+   limiter = get_limiter(model_name)
+   tokens = estimate_tokens(query)
+   messages = [
+      {"role": "system", "content": system_prompt},
+      {"role": "user", "content": query}
+   ]
+   usage = None
+   if on_chunk is None:
+      response = create_completion(get_client(api_key), limiter, model_name, messages, tokens)
+      content = response.choices[0].message.content
+      usage = response.usage
+   else:
+      # Only the opening of the stream is retried; once content has been forwarded it can't be taken back
+      response = create_completion(
+         get_client(api_key), limiter, model_name, messages, tokens,
+         stream=True, stream_options={"include_usage": True}
+      )
+      chunks = []
+      for event in response:
+         usage = getattr(event, "usage", None) or usage
+         delta = event.choices[0].delta.content if event.choices else None
+         if delta:
+            chunks.append(delta)
+            on_chunk(delta)
+      content = "".join(chunks)
+   if usage is not None and getattr(usage, "total_tokens", None):
+      limiter.adjust({"tokens": usage.total_tokens - tokens})
+   return content
+
+
+class OpenAIGenerationBackend(GenerationBackend):
+   """
+   Generates entries with the OpenAI model named by OPENAI_MODEL_NAME (see request_new_entry).
+   """
+   system_prompt = system_prompt
+
+   @property
+   def model_name(self):
+      return getattr(settings, "OPENAI_MODEL_NAME", None)
+
+   def generate(self, query, on_chunk=None):
+      return request_new_entry(query, on_chunk=on_chunk)
@@ -0,0 +1,615 @@
+import hashlib
+import html
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Func, IntegerField, Q, TextField, Value, When
+from django.utils.module_loading import import_string
+from .linker import get_corpus_version
+from .utils import TERM_PATTERN, strip_html
+
+
+class TitleTrie:
+    """
+    A character trie of entry titles for autocompletion without database support.
+    Each title is added from the start of each of its words, so that any word of a title can be
+    completed, and prefixes are matched within max_edits edits to tolerate typos.
+    """
+    def __init__(self, titles):
+        self.root = {}
+        for title, slug in titles:
+            words = title.lower().split()
+            for position in range(len(words)):
+                node = self.root
+                for char in " ".join(words[position:]):
+                    node = node.setdefault(char, {})
+                node.setdefault('', []).append((title, slug, position))  # '' holds the titles that end here
+
+    def _matches(self, prefix, max_edits):
+        """
+        Yields (edits, node) for each node whose path is within max_edits of the prefix, using a
+        row of the Levenshtein table per node so that branches that can't match are cut short.
+        """
+        stack = [(self.root, list(range(len(prefix) + 1)))]
+        while stack:
+            node, row = stack.pop()
+            if row[-1] <= max_edits:
+                yield row[-1], node
+            if min(row) > max_edits:
+                continue
+            for char, child in node.items():
+                if char:
+                    next_row = [row[0] + 1]
+                    for position, prefix_char in enumerate(prefix, start=1):
+                        next_row.append(min(next_row[-1] + 1, row[position] + 1, row[position - 1] + (prefix_char != char)))
+                    stack.append((child, next_row))
+
+    def _completions(self, node, limit):
+        """
+        Yields up to limit of the titles below the node, shortest first.
+        """
+        queue = [node]
+        count = 0
+        for node in queue:
+            for title in node.get('', ()):
+                yield title
+                count += 1
+                if count >= limit:
+                    return
+            queue.extend(child for char, child in sorted(node.items()) if char)
+
+    def suggest(self, prefix, limit=10, max_edits=1):
+        """
+        Returns up to limit (title, slug) pairs, closest to the prefix first; titles that
+        start with the prefix rank before those with a later word that does.
+        """
+        prefix = " ".join(prefix.lower().split())
+        best = {}
+        for edits, node in self._matches(prefix, max_edits):
+            for title, slug, position in self._completions(node, limit * 5):
+                rank = (edits, position > 0, len(title), title)
+                if slug not in best or rank < best[slug][0]:
+                    best[slug] = (rank, title)
+        return [(title, slug) for slug, (rank, title) in sorted(best.items(), key=lambda item: item[1][0])[:limit]]
+
+
+_title_trie = (None, None)  # (corpus version, TitleTrie) for this process
+
+def get_title_trie():
+    """
+    Returns a TitleTrie of every entry title, built once per process and corpus version.
+    """
+    global _title_trie
+    from .models import Entry
+    version = get_corpus_version()
+    trie_version, trie = _title_trie
+    if trie is None or version is None or trie_version != version:
+        trie = TitleTrie(Entry.objects.values_list('title', 'slug'))
+        _title_trie = (version, trie)
+    return trie
+
+
+class InvertedIndex:
+    """
+    An inverted index of entry text for ranking matches with BM25 without database support.
+
+    Documents are numbered as they are added, so each term's postings (the ids of the documents
+    that contain it and how often) are kept sorted by only ever appending to them. Changing an
+    entry adds it as a new document and marks the old one dead; dead documents are skipped when
+    searching and dropped by compact() and save().
+
+    Postings are pairs of array('I') rather than lists of ints, and a snapshot written by save()
+    holds them in one block of 32-bit integers that load() maps into memory instead of reading,
+    so that a process starts with a full index and only pages in the postings it searches.
+    Postings added after loading are kept in memory alongside those in the snapshot.
+    """
+    k1 = 1.2  # BM25 term frequency saturation
+    b = 0.75  # BM25 document length normalisation
+    title_weight = 3  # A term in the title counts as this many occurrences
+    magic = b'SGIDX1'
+
+    def __init__(self):
+        self.slugs = []  # Document id: slug, or None once the document is dead
+        self.doc_ids = {}  # Slug: document id of each live document
+        self.lengths = array('I')  # Document id: weighted number of terms
+        self.updated = array('d')  # Document id: timestamp of the entry's date_updated
+        self.total_length = 0  # Of the live documents
+        self.postings = {}  # Term: (document ids, frequencies) added since the snapshot
+        self.snapshot_terms = {}  # Term: (offset, count) of its postings in snapshot_block
+        self.snapshot_block = memoryview(array('I'))
+        self.snapshot_map = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @property
+    def dead(self):
+        return len(self.slugs) - len(self.doc_ids)
+
+    @property
+    def watermark(self):
+        """
+        The timestamp of the most recently updated document, or None if the index is empty.
+        """
+        return max(self.updated) if self.updated else None
+
+    def terms(self, title, description):
+        frequencies = {}
+        for term in TERM_PATTERN.findall(strip_html(description).lower()):
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term in TERM_PATTERN.findall(title.lower()):
+            frequencies[term] = frequencies.get(term, 0) + self.title_weight
+        return frequencies
+
+    def updated_at(self, slug):
+        doc_id = self.doc_ids.get(slug)
+        return None if doc_id is None else self.updated[doc_id]
+
+    def add(self, slug, title, description, updated=0.0):
+        """
+        Indexes an entry's text, replacing what was indexed for it before.
+        """
+        self.remove(slug)
+        doc_id = len(self.slugs)
+        frequencies = self.terms(title, description)
+        length = sum(frequencies.values())
+        self.slugs.append(slug)
+        self.doc_ids[slug] = doc_id
+        self.lengths.append(length)
+        self.updated.append(updated)
+        self.total_length += length
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = (array('I'), array('I'))
+            doc_ids, term_frequencies = self.postings[term]
+            doc_ids.append(doc_id)
+            term_frequencies.append(frequency)
+
+    def remove(self, slug):
+        doc_id = self.doc_ids.pop(slug, None)
+        if doc_id is not None:
+            self.slugs[doc_id] = None
+            self.total_length -= self.lengths[doc_id]
+
+    def segments(self, term):
+        """
+        Returns the (document ids, frequencies) sequences of the term's postings, in order of document id.
+        """
+        segments = []
+        if term in self.snapshot_terms:
+            offset, count = self.snapshot_terms[term]
+            block = self.snapshot_block
+            segments.append((block[offset:offset + count], block[offset + count:offset + 2 * count]))
+        if term in self.postings:
+            segments.append(self.postings[term])
+        return segments
+
+    def search(self, query, limit=None):
+        """
+        Returns (slug, score) for up to limit of the documents containing every term of the query, best first.
+        """
+        terms = list(dict.fromkeys(TERM_PATTERN.findall(query.lower())))
+        if not terms or not self.doc_ids:
+            return []
+        segments = {term: self.segments(term) for term in terms}
+        # Document frequencies include dead documents until the index is compacted
+        counts = {term: sum(len(doc_ids) for doc_ids, frequencies in segments[term]) for term in terms}
+        if not all(counts.values()):
+            return []
+        terms.sort(key=counts.get)
+        documents = len(self.doc_ids)
+        average_length = self.total_length / documents or 1
+        idfs = {term: math.log(1 + (documents - min(counts[term], documents) + 0.5) / (counts[term] + 0.5)) for term in terms}
+
+        def score(term, frequency, doc_id):
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+            return idfs[term] * frequency * (self.k1 + 1) / (frequency + norm)
+
+        scores = {}
+        rarest, others = terms[0], terms[1:]
+        for doc_ids, frequencies in segments[rarest]:
+            for doc_id, frequency in zip(doc_ids, frequencies):
+                if self.slugs[doc_id] is None:
+                    continue
+                total = score(rarest, frequency, doc_id)
+                for term in others:
+                    frequency = self.frequency(segments[term], doc_id)
+                    if not frequency:
+                        break
+                    total += score(term, frequency, doc_id)
+                else:
+                    scores[doc_id] = total
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        return [(self.slugs[doc_id], rank) for doc_id, rank in ranked[:limit]]
+
+    @staticmethod
+    def frequency(segments, doc_id):
+        for doc_ids, frequencies in segments:
+            position = bisect_left(doc_ids, doc_id)
+            if position < len(doc_ids) and doc_ids[position] == doc_id:
+                return frequencies[position]
+        return 0
+
+    def live_postings(self):
+        """
+        Yields (term, document ids, frequencies) for every term, with the live documents
+        renumbered in order from 0 as they are in self.doc_ids after compact().
+        """
+        renumbered = {doc_id: position for position, doc_id in enumerate(sorted(self.doc_ids.values()))}
+        for term in sorted(self.snapshot_terms.keys() | self.postings.keys()):
+            doc_ids, frequencies = array('I'), array('I')
+            for segment_ids, segment_frequencies in self.segments(term):
+                for doc_id, frequency in zip(segment_ids, segment_frequencies):
+                    if doc_id in renumbered:
+                        doc_ids.append(renumbered[doc_id])
+                        frequencies.append(frequency)
+            if doc_ids:
+                yield term, doc_ids, frequencies
+
+    def compact(self):
+        """
+        Drops the dead documents, moving every posting into memory.
+        """
+        postings = {term: (doc_ids, frequencies) for term, doc_ids, frequencies in self.live_postings()}
+        live = sorted(self.doc_ids.values())
+        self.slugs = [self.slugs[doc_id] for doc_id in live]
+        self.doc_ids = {slug: doc_id for doc_id, slug in enumerate(self.slugs)}
+        self.lengths = array('I', (self.lengths[doc_id] for doc_id in live))
+        self.updated = array('d', (self.updated[doc_id] for doc_id in live))
+        self.postings = postings
+        self.snapshot_terms = {}
+        self.snapshot_block = memoryview(array('I'))
+        self.snapshot_map = None
+
+    def save(self, path):
+        """
+        Writes a snapshot of the live documents: the magic bytes, the length of a JSON header,
+        the header, and then, aligned to 4 bytes, a block of native 32-bit integers holding the
+        document lengths followed by each term's document ids and frequencies.
+        The file is replaced atomically, so processes loading it never see a partial snapshot.
+        """
+        live = sorted(self.doc_ids.values())
+        block = array('I', (self.lengths[doc_id] for doc_id in live))
+        terms = {}
+        for term, doc_ids, frequencies in self.live_postings():
+            terms[term] = (len(block), len(doc_ids))
+            block.extend(doc_ids)
+            block.extend(frequencies)
+        header = json.dumps({
+            'byteorder': sys.byteorder,
+            'itemsize': block.itemsize,
+            'slugs': [self.slugs[doc_id] for doc_id in live],
+            'updated': [self.updated[doc_id] for doc_id in live],
+            'terms': terms,
+        }).encode()
+        prefix = self.magic + struct.pack('<Q', len(header)) + header
+        padding = -len(prefix) % block.itemsize
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(prefix + b'\0' * padding)
+            block.tofile(file)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the index in a snapshot written by save(), with its postings mapped from the file.
+        Raises ValueError if the file is not a snapshot this machine can read.
+        """
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(cls.magic) + 8
+        if mapped[:len(cls.magic)] != cls.magic:
+            raise ValueError(f"{path} is not a search index snapshot")
+        header_length, = struct.unpack_from('<Q', mapped, len(cls.magic))
+        header = json.loads(mapped[start:start + header_length])
+        if header['byteorder'] != sys.byteorder or header['itemsize'] != array('I').itemsize:
+            raise ValueError(f"{path} was written on a machine with a different integer layout")
+        block_start = start + header_length + (-(start + header_length) % header['itemsize'])
+        index = cls()
+        index.snapshot_map = mapped
+        index.snapshot_block = memoryview(mapped)[block_start:].cast('I')
+        index.snapshot_terms = {term: tuple(position) for term, position in header['terms'].items()}
+        index.slugs = header['slugs']
+        index.doc_ids = {slug: doc_id for doc_id, slug in enumerate(index.slugs)}
+        index.lengths = array('I', index.snapshot_block[:len(index.slugs)])
+        index.updated = array('d', header['updated'])
+        index.total_length = sum(index.lengths)
+        return index
+
+
+class SearchBackend:
+    """
+    Finds the entries that match a text query. The backend in use is named by the ENTRY_SEARCH_BACKEND setting.
+    """
+    snippet_length = 200  # Characters of text around the first match
+
+    def index_entry(self, entry):
+        """
+        Brings the index up to date with an entry whose title or description has changed.
+        """
+        pass
+
+    def remove_entry(self, slug):
+        pass
+
+    def rebuild(self):
+        """
+        Indexes every entry from scratch.
+        """
+        pass
+
+    def search(self, queryset, query):
+        """
+        Returns the entries of the queryset that match the query, best first, annotated with their `rank`.
+        """
+        raise NotImplementedError('method \'search\' has no default behavior and must be defined')
+
+    def suggest(self, prefix, limit):
+        """
+        Returns up to limit (title, slug) pairs of the entries whose titles best complete the prefix,
+        allowing for typos. By default these come from a TitleTrie kept in memory.
+        """
+        max_edits = 1 if len(prefix) >= settings.ENTRY_SUGGEST_TYPO_LENGTH else 0
+        return get_title_trie().suggest(prefix, limit, max_edits=max_edits)
+
+    def snippets(self, entries, query):
+        """
+        Returns {slug: snippet} for the entries, where a snippet is an HTML excerpt of the entry's
+        text around the first match for the query, with the matching terms in <mark> tags.
+        """
+        terms = TERM_PATTERN.findall(query.lower())
+        if not terms:
+            return {}
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\w*", re.IGNORECASE)
+        snippets = {}
+        for entry in entries:
+            text = " ".join(strip_html(entry.description).split())
+            match = pattern.search(text)
+            start = max(0, match.start() - self.snippet_length // 4) if match else 0
+            excerpt = html.escape(text[start:start + self.snippet_length])
+            snippets[entry.slug] = pattern.sub(lambda match: f"<mark>{match.group()}</mark>", excerpt)
+        return snippets
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """
+    Substring matching that works on any database, with matches in the title ranked first.
+    It scans every entry, so it is only suitable for small corpora.
+    """
+    def search(self, queryset, query):
+        matches_title = Q(title__icontains=query)
+        return (
+            queryset.filter(matches_title | Q(description__icontains=query))
+            .annotate(rank=Case(When(matches_title, then=Value(1)), default=Value(0), output_field=IntegerField()))
+            .order_by('-rank', 'title')
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    PostgreSQL full text search over Entry.search_vector, which holds the title (weight A) and the
+    description stripped of its tags (weight B) and is covered by a GIN index.
+    Queries use the web search syntax ("quoted phrases", or, -excluded).
+    """
+    @property
+    def config(self):
+        return settings.ENTRY_SEARCH_CONFIG
+
+    def stripped_description(self):
+        return Func(F('description'), Value(r'<[^>]*>'), Value(' '), Value('g'), function='regexp_replace', output_field=TextField())
+
+    def vector(self):
+        return (
+            SearchVector('title', weight='A', config=self.config)
+            + SearchVector(self.stripped_description(), weight='B', config=self.config)
+        )
+
+    def query(self, query):
+        return SearchQuery(query, config=self.config, search_type='websearch')
+
+    def index_entry(self, entry):
+        type(entry).objects.filter(pk=entry.pk).update(search_vector=self.vector())
+
+    def rebuild(self):
+        from .models import Entry
+        Entry.objects.update(search_vector=self.vector())
+
+    def search(self, queryset, query):
+        search_query = self.query(query)
+        return (
+            queryset.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-rank', 'title')
+        )
+
+    def suggest(self, prefix, limit):
+        """
+        Titles within the pg_trgm word similarity threshold of the prefix, found with the
+        trigram index on Entry.title. Prefixes too short to have a trigram are matched literally.
+        """
+        from .models import Entry
+        if len(prefix) < 2:
+            return list(Entry.objects.filter(title__istartswith=prefix).order_by('title').values_list('title', 'slug')[:limit])
+        return list(
+            Entry.objects.filter(title__trigram_word_similar=prefix)
+            .annotate(
+                similarity=TrigramWordSimilarity(prefix, 'title'),
+                starts_with=Case(When(title__istartswith=prefix, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            )
+            .order_by('-starts_with', '-similarity', 'title')
+            .values_list('title', 'slug')[:limit]
+        )
+
+    def snippets(self, entries, query):
+        from .models import Entry
+        headlines = Entry.objects.filter(pk__in=[entry.pk for entry in entries]).annotate(
+            snippet=SearchHeadline(
+                self.stripped_description(), self.query(query), config=self.config,
+                start_sel='<mark>', stop_sel='</mark>', min_words=15, max_words=35,
+            )
+        ).values_list('slug', 'snippet')
+        return dict(headlines)
+
+
+SEARCH_INDEX_VERSION_KEY = 'entries:search_index:version'
+
+def get_search_index_version():
+    cache.add(SEARCH_INDEX_VERSION_KEY, 1, timeout=None)
+    return cache.get(SEARCH_INDEX_VERSION_KEY)
+
+def bump_search_index_version():
+    try:
+        cache.incr(SEARCH_INDEX_VERSION_KEY)
+    except ValueError:
+        cache.add(SEARCH_INDEX_VERSION_KEY, 1, timeout=None)
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """
+    BM25 ranking over an InvertedIndex kept in each process, for deployments without PostgreSQL.
+    Queries match the entries containing every one of their terms.
+
+    A process starts from the snapshot at ENTRY_SEARCH_INDEX_PATH, or builds the index and writes
+    one, and then catches up with the entries updated since (see refresh). Changes saved in this
+    process are indexed as they are committed; other processes see the version in the cache
+    change and refresh before their next search.
+    """
+    candidates = 500  # Most matches passed to the database for filtering and ordering
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.lock = threading.RLock()
+
+    @property
+    def path(self):
+        return settings.ENTRY_SEARCH_INDEX_PATH
+
+    def build(self):
+        from .models import Entry
+        index = InvertedIndex()
+        for slug, title, description, updated in Entry.objects.values_list('slug', 'title', 'description', 'date_updated').iterator():
+            index.add(slug, title, description, updated.timestamp())
+        return index
+
+    def get_index(self):
+        with self.lock:
+            if self.index is None:
+                try:
+                    self.index = InvertedIndex.load(self.path)
+                except (OSError, ValueError, KeyError):
+                    self.index = self.build()
+                    self.snapshot()
+            version = get_search_index_version()
+            if version is None or version != self.version:
+                self.refresh()
+                self.version = version
+            return self.index
+
+    def refresh(self):
+        """
+        Indexes the entries updated since the most recent one in the index, going back
+        ENTRY_SEARCH_INDEX_LAG seconds for transactions that committed out of order, and removes
+        the entries that have been deleted.
+        """
+        from .models import Entry
+        index = self.index
+        entries = Entry.objects.values_list('slug', 'title', 'description', 'date_updated')
+        if index.watermark is not None:
+            since = datetime.fromtimestamp(index.watermark, tz=timezone.utc) - timedelta(seconds=settings.ENTRY_SEARCH_INDEX_LAG)
+            entries = entries.filter(date_updated__gt=since)
+        for slug, title, description, updated in entries.iterator():
+            if index.updated_at(slug) != updated.timestamp():
+                index.add(slug, title, description, updated.timestamp())
+        # Every entry updated since is indexed, so any more in the index have been deleted
+        if len(index) != Entry.objects.count():
+            for slug in index.doc_ids.keys() - set(Entry.objects.values_list('slug', flat=True)):
+                index.remove(slug)
+        if index.dead > len(index):
+            index.compact()
+
+    def snapshot(self):
+        """
+        Writes the index to ENTRY_SEARCH_INDEX_PATH for processes that start later.
+        """
+        with self.lock:
+            try:
+                self.index.save(self.path)
+            except OSError:
+                pass  # Processes that start later build the index instead
+
+    def index_entry(self, entry):
+        slug, title, description, updated = entry.slug, entry.title, entry.description, entry.date_updated.timestamp()
+
+        def add():
+            with self.lock:
+                if self.index is not None:
+                    self.index.add(slug, title, description, updated)
+            bump_search_index_version()
+        transaction.on_commit(add)
+
+    def remove_entry(self, slug):
+        def remove():
+            with self.lock:
+                if self.index is not None:
+                    self.index.remove(slug)
+            bump_search_index_version()
+        transaction.on_commit(remove)
+
+    def rebuild(self):
+        with self.lock:
+            self.index = self.build()
+            self.snapshot()
+        bump_search_index_version()
+
+    def search(self, queryset, query):
+        ranks = dict(self.get_index().search(query, limit=self.candidates))
+        if not ranks:
+            return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+        return (
+            queryset.filter(pk__in=list(ranks))
+            .annotate(rank=Case(*[When(pk=slug, then=Value(rank)) for slug, rank in ranks.items()], output_field=FloatField()))
+            .order_by('-rank', 'title')
+        )
+
+
+_backends = {}
+
+def get_search_backend():
+    path = settings.ENTRY_SEARCH_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+def suggest_titles(prefix, limit=None):
+    """
+    Returns up to limit (title, slug) pairs completing the prefix, from the search backend.
+    Results are cached per prefix and corpus version, so they stay cached until an entry is
+    created, renamed or deleted.
+    """
+    prefix = " ".join(prefix.split())[:120]
+    limit = min(limit or settings.ENTRY_SUGGEST_LIMIT, settings.ENTRY_SUGGEST_LIMIT)
+    if not prefix:
+        return []
+    version = get_corpus_version()
+    key = f"entries:suggest:{version}:{limit}:{hashlib.sha256(prefix.lower().encode()).hexdigest()}"
+    suggestions = cache.get(key) if version is not None else None
+    if suggestions is None:
+        suggestions = get_search_backend().suggest(prefix, limit)
+        if version is not None:
+            cache.set(key, suggestions, timeout=settings.ENTRY_SUGGEST_CACHE_TIMEOUT)
+    return suggestions
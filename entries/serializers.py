@@ -1,10 +1,24 @@
-from .models import Entry
+from django.conf import settings
+from .linker import render_links
+from .models import Entry, EntryLink
 from rest_framework import serializers
 
 class FullEntrySerializer(serializers.ModelSerializer):
+    tags = serializers.SerializerMethodField()
+
     class Meta:
         model = Entry
-        fields = '__all__'
+        exclude = ('search_vector', 'link_pending')
+
+    def get_tags(self, instance):
+        # Fetch entries with Entry.objects.with_tags() to avoid a query per entry
+        return sorted(instance.tag_list)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if settings.ENTRY_LINK_MODE == 'render':
+            data['description'] = render_links(instance)
+        return data
 
 class CreateEntrySerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,4 +28,12 @@ class CreateEntrySerializer(serializers.ModelSerializer):
 class DisplayEntrySerializer(serializers.ModelSerializer):
     class Meta:
         model = Entry
-        exclude = ('slug', 'date_created', 'date_updated')
\ No newline at end of file
+        exclude = ('slug', 'date_created', 'date_updated', 'search_vector', 'link_pending')
+
+class EntryLinkSerializer(serializers.ModelSerializer):
+    source_title = serializers.CharField(source='source.title', read_only=True)
+    target_title = serializers.CharField(source='target.title', read_only=True)
+
+    class Meta:
+        model = EntryLink
+        fields = ('source', 'source_title', 'target', 'target_title', 'anchor_text')
@@ -0,0 +1,32 @@
+from django.db import connections, transaction
+from .linker import bump_corpus_version
+from .search import get_search_backend
+
+
+def create_search_extensions(using='default', **kwargs):
+    """
+    Creates the PostgreSQL extensions that the search indexes need, before any migrations run.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+def index_entry(sender, instance, update_fields=None, **kwargs):
+    """
+    Brings the search index up to date with a saved entry, unless only fields that aren't searched were saved.
+    """
+    if update_fields is None or {'title', 'description'} & set(update_fields):
+        get_search_backend().index_entry(instance)
+
+def remove_entry(sender, instance, **kwargs):
+    """
+    Removes a deleted entry from the search index, including entries deleted with a queryset.
+    """
+    get_search_backend().remove_entry(instance.slug)
+
+def remove_entry_title(sender, instance, using=None, **kwargs):
+    """
+    Bumps the corpus version once a deleted entry is committed, including entries deleted with a queryset.
+    """
+    transaction.on_commit(bump_corpus_version, using=using)
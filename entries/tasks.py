@@ -1,53 +1,493 @@
-from bs4 import BeautifulSoup
-import re
-from celery import shared_task
-from .models import Entry
+import time
+import uuid
+from contextlib import contextmanager
+from celery import chain, chord, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.text import slugify
+from .linker import EntryLinker, get_corpus_linker, unlink
+from .models import Entry, EntryLink, EntryTerm
+from .notifications import EntryStream, notify_user
+from .generation import generate_entry
+from .serializers import CreateEntrySerializer
+from .utils import format_entry
 
 import logging
 logger = logging.getLogger("django")
 
+LINK_BATCH_KEY = 'entries:link_batch_scheduled'
+
+def rewrite_descriptions(entry_pks, rewrite, chunk_size=100, replace_links=False):
+    """
+    Applies rewrite(entry) -> (description, links) to the description of each entry.
+    Rows are locked in slug order and re-read before they are rewritten, so that concurrent
+    linking passes and edits never overwrite each other's changes.
+    The links of changed entries are recorded in the same transaction. With replace_links, rewrite
+    must return every link of the entry, and the links recorded for each entry are replaced with
+    them whether or not its description changed.
+    Returns the number of entries changed and the (source, target, anchor text) of the links recorded.
+    """
+    entry_pks = sorted(entry_pks)
+    updated_count = 0
+    recorded_links = []
+    for start in range(0, len(entry_pks), chunk_size):
+        chunk_pks = entry_pks[start:start + chunk_size]
+        with transaction.atomic():
+            entries = (
+                Entry.objects.select_for_update()
+                .filter(pk__in=chunk_pks)
+                .only('slug', 'description')
+                .order_by('slug')
+            )
+            updated_entries = []
+            new_links = []
+            for entry in entries:
+                description, links = rewrite(entry)
+                changed = description != entry.description
+                if changed:
+                    entry.description = description
+                    updated_entries.append(entry)
+                if changed or replace_links:
+                    new_links += [(entry.slug, slug, anchor_text) for slug, anchor_text in links]
+            if updated_entries:
+                Entry.objects.bulk_update(updated_entries, ['description'])
+            if replace_links:
+                EntryLink.objects.filter(source__in=chunk_pks).delete()
+            if new_links:
+                EntryLink.objects.add_links(new_links)
+        updated_count += len(updated_entries)
+        recorded_links += new_links
+    return updated_count, recorded_links
+
+def link_entries(entry_pks):
+    """
+    One linking pass for a batch of entries: the batch is linked to the whole corpus,
+    and the entries that mention any of the batch are linked to it.
+    Returns the number of entries changed.
+    """
+    entries = list(Entry.objects.filter(pk__in=entry_pks).only('slug', 'title'))
+    if not entries:
+        return 0
+    entry_pks = [entry.pk for entry in entries]
+
+    # Update entries with links to other entries
+    linker = EntryLinker(Entry.objects.values_list('title', 'slug'))
+    updated_count, links = rewrite_descriptions(
+        entry_pks, lambda entry: linker.link(entry.description, exclude=(entry.slug,))
+    )
+    logger.info(f"[link_entries] Added {len(links)} links to {updated_count} new entries")
+
+    # Update other entries with links to the new entries
+    # Only entries containing every term of a title can mention it.
+    batch_linker = EntryLinker([(entry.title, entry.slug) for entry in entries])
+    candidate_pks = set()
+    for entry in entries:
+        candidate_pks.update(
+            EntryTerm.objects.mentioning(entry.title).exclude(pk__in=entry_pks).values_list('pk', flat=True)
+        )
+    other_count, links = rewrite_descriptions(
+        candidate_pks, lambda entry: batch_linker.link(entry.description, exclude=(entry.slug,))
+    )
+    logger.info(f"[link_entries] Added {len(links)} links to the new entries in {other_count} entries")
+    return updated_count + other_count
+
+def schedule_hyperlinks(*entry_pks):
+    """
+    Marks entries as waiting to be linked and makes sure that a linking pass is due.
+    Entries scheduled within ENTRY_LINK_BATCH_WINDOW seconds of each other are linked in the same pass.
+    """
+    if entry_pks:
+        Entry.objects.filter(pk__in=entry_pks).update(link_pending=True)
+    # Only once committed, so that a rolled back transaction never holds off the pass for its window
+    transaction.on_commit(queue_linking_pass)
+
+def queue_linking_pass():
+    """
+    Queues a linking pass in ENTRY_LINK_BATCH_WINDOW seconds, unless one is already due.
+    """
+    window = settings.ENTRY_LINK_BATCH_WINDOW
+    if cache.add(LINK_BATCH_KEY, True, timeout=window):
+        try:
+            hyperlink_pending_entries.apply_async(countdown=window)
+        except Exception:
+            cache.delete(LINK_BATCH_KEY)
+            raise
+
+@shared_task(bind=True, max_retries=3)
+def hyperlink_pending_entries(self):
+    """
+    Links up to ENTRY_LINK_BATCH_SIZE of the entries marked by schedule_hyperlinks in one pass.
+    Pending entries are claimed with SKIP LOCKED, so concurrent passes never share an entry.
+    A pass that fails gives its entries back and is retried after ENTRY_LINK_BATCH_WINDOW seconds.
+    """
+    # Entries scheduled from here on need a new pass, unless this one claims them
+    cache.delete(LINK_BATCH_KEY)
+    with transaction.atomic():
+        entry_pks = list(
+            Entry.objects.select_for_update(skip_locked=True)
+            .filter(link_pending=True)
+            .order_by('slug')
+            .values_list('pk', flat=True)[:settings.ENTRY_LINK_BATCH_SIZE]
+        )
+        Entry.objects.filter(pk__in=entry_pks).update(link_pending=False)
+    if not entry_pks:
+        return 0
+    logger.info(f"[hyperlink_pending_entries] Linking {len(entry_pks)} entries")
+    try:
+        updated_count = link_entries(entry_pks)
+    except Exception as e:
+        logger.error(f"[hyperlink_pending_entries] Error for {len(entry_pks)} entries: {e}")
+        Entry.objects.filter(pk__in=entry_pks).update(link_pending=True)
+        raise self.retry(exc=e, countdown=settings.ENTRY_LINK_BATCH_WINDOW)
+    if len(entry_pks) == settings.ENTRY_LINK_BATCH_SIZE:
+        hyperlink_pending_entries.delay()  # There may be more waiting
+    return updated_count
+
 @shared_task
 def hyperlink_entry(entry_pk):
     logger.info(f"[hyperlink_entry] Starting for {entry_pk}")
+    try:
+        link_entries([entry_pk])
+    except Exception as e:
+        logger.error(f"[hyperlink_entry] Error for entry_pk={entry_pk}: {e}")
 
-    def replace_titles_with_links(entry_title, html_content, link_title, link_slug):
-        html = BeautifulSoup(html_content, 'html.parser')
+@shared_task
+def unlink_entry(entry_slug, source_slugs):
+    """
+    Removes links to a deleted entry from the entries that linked to it.
+    """
+    logger.info(f"[unlink_entry] Starting for {entry_slug}")
+    try:
+        updated_count, _ = rewrite_descriptions(
+            source_slugs, lambda entry: (unlink(entry.description, entry_slug), [])
+        )
+        logger.info(f"[unlink_entry] Removed links to {entry_slug} from {updated_count} entries")
+
+    except Exception as e:
+        logger.error(f"[unlink_entry] Error for entry_slug={entry_slug}: {e}")
+
+@shared_task
+def relink_chunk(first_slug, last_slug):
+    """
+    Strips the entry links from every entry with a slug in [first_slug, last_slug]
+    and links it again with the current rules, against the corpus matcher shared by the worker.
+    """
+    linker = get_corpus_linker()
+    entry_pks = list(Entry.objects.filter(slug__gte=first_slug, slug__lte=last_slug).values_list('pk', flat=True))
+    updated_count, links = rewrite_descriptions(
+        entry_pks, lambda entry: linker.link(unlink(entry.description), exclude=(entry.slug,)), replace_links=True
+    )
+    logger.info(f"[relink_chunk] {first_slug} to {last_slug}: {updated_count} of {len(entry_pks)} entries changed")
+    return {'entries': len(entry_pks), 'updated': updated_count, 'links': len(links)}
+
+@shared_task
+def relink_complete(results):
+    totals = {key: sum(result[key] for result in results) for key in ('entries', 'updated', 'links')}
+    logger.info(
+        f"[relink_complete] Relinked {totals['entries']} entries in {len(results)} chunks: "
+        f"{totals['updated']} changed, {totals['links']} links"
+    )
+    return totals
+
+def relink_corpus(chunk_size=500):
+    """
+    Relinks every entry by splitting the corpus into slug ranges of chunk_size entries,
+    which are processed in parallel by relink_chunk, with relink_complete reporting the totals.
+    Returns the AsyncResult of the chord, whose parent is the result of the chunks.
+    """
+    slugs = list(Entry.objects.order_by('slug').values_list('slug', flat=True))
+    chunks = [
+        relink_chunk.s(slugs[start], slugs[min(start + chunk_size, len(slugs)) - 1])
+        for start in range(0, len(slugs), chunk_size)
+    ]
+    return chord(chunks)(relink_complete.s())
 
-        text_nodes = []
-        for element in html.find_all(text=True):
-            if element.parent.name != 'a':  # Skip text inside <a> tags
-                text_nodes.append(element)
 
-        # Replace title in each text node
-        for text_node in text_nodes:
-            pattern = r'(?i)(?<!\w)(' + re.escape(link_title) + r')(?!\w)'
-            replacement = f'<a href="/entries/{link_slug}">{re.escape(link_title)}</a>'
-            new_text = re.sub(pattern, replacement, str(text_node))
+### Entry requests ###
+# A request for a new entry runs as a chain of tasks, each passing on a job dict.
+# Once a step sets the job's status, the remaining steps leave it alone and it goes straight to notify.
+# Only one job generates a given slug at a time: it is the leader of that slug's flight, and jobs
+# for the same slug that arrive while it runs wait on it and are notified with its result.
 
-            # Only replace if something changed
-            if new_text != str(text_node):
-                new_html = BeautifulSoup(new_text, 'html.parser')
-                text_node.replace_with(new_html)
-                logger.info(f"[hyperlink_entry] Added link to {link_title} to {entry_title}")
-        return html
+FLIGHT_KEY = 'entries:request:{slug}'  # The job id of the leader generating the slug
+FLIGHT_WAITERS_KEY = 'entries:request:{slug}:waiters'  # [(user slug, job id)] of the jobs waiting on it
+FLIGHT_MUTEX_KEY = 'entries:request:{slug}:mutex'  # A token held by the worker changing the flight
+FLIGHT_MUTEX_TIMEOUT = 10  # Seconds before the mutex of a worker that died is released
 
+@contextmanager
+def flight_mutex(slug):
+    """
+    Serialises changes to a flight between workers. The mutex of a worker that died expires
+    after FLIGHT_MUTEX_TIMEOUT seconds, so waiting longer than that raises TimeoutError.
+    Only the holder's own token is released, in case it held the mutex for so long that it
+    expired and was taken by another worker.
+    """
+    key = FLIGHT_MUTEX_KEY.format(slug=slug)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + FLIGHT_MUTEX_TIMEOUT * 1.5
+    while not cache.add(key, token, timeout=FLIGHT_MUTEX_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for the flight mutex of {slug}")
+        time.sleep(0.05)
     try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+def join_flight(job):
+    """
+    Makes the job the leader of its slug's flight, or adds it to the waiters of the current leader.
+    Returns True if the job leads.
+    """
+    key = FLIGHT_KEY.format(slug=job['slug'])
+    waiters_key = FLIGHT_WAITERS_KEY.format(slug=job['slug'])
+    with flight_mutex(job['slug']):
+        if cache.add(key, job['job_id'], timeout=settings.ENTRY_REQUEST_FLIGHT_TIMEOUT):
+            cache.delete(waiters_key)
+            return True
+        waiters = cache.get(waiters_key) or []
+        waiters.append((job['user_slug'], job['job_id']))
+        cache.set(waiters_key, waiters, timeout=settings.ENTRY_REQUEST_FLIGHT_TIMEOUT)
+    return False
+
+def land_flight(job):
+    """
+    Ends the flight led by the job and returns the waiters to notify with its result.
+    """
+    key = FLIGHT_KEY.format(slug=job['slug'])
+    waiters_key = FLIGHT_WAITERS_KEY.format(slug=job['slug'])
+    with flight_mutex(job['slug']):
+        if cache.get(key) != job['job_id']:  # Expired and taken over; its waiters belong to the new leader
+            return []
+        waiters = cache.get(waiters_key) or []
+        cache.delete_many([key, waiters_key])
+    return waiters
+
+def new_entry_job(query, user, stream=True):
+    return {
+        'job_id': uuid.uuid4().hex,
+        'query': query,
+        'slug': None,
+        'user_slug': user.slug,
+        'user_email': user.email,
+        'content': None,
+        'status': None,
+        'message': None,
+        'leader': False,
+        'stream': stream,  # Whether the content is sent to the user as it is generated
+    }
+
+def queue_entry_request(query, user, eager=False):
+    """
+    Queues the generation of an entry for the query and returns the result of the job.
+    Its id is the job id, which is also sent with the user's notifications.
+    With eager, the job is run in this process and has finished when this returns.
+    """
+    job = new_entry_job(query, user)
+    job_chain = chain(
+        validate_entry_request.s(job),
+        dedupe_entry_request.s(),
+        generate_entry_content.s(),
+        format_entry_content.s(),
+        save_entry_content.s(),
+        link_new_entry.s(),
+        notify_entry_request.s().set(task_id=job['job_id']),
+    )
+    job_chain.link_error(fail_entry_request.s())
+    return job_chain.apply() if eager else job_chain.apply_async()
 
-        entry = Entry.objects.get(pk=entry_pk)
-        entries = Entry.objects.all()
-        entry_titles = entries.values_list('title', 'slug')
-        updated_entries = []
-        # Update entry with links to other entries
-        for title, slug in entry_titles:
-            entry.description = replace_titles_with_links(entry.title, entry.description, title, slug)
-        entry.save()
-
-        # Update other entries with link to new entry
-        for other_entry in entries:
-            other_entry.description = replace_titles_with_links(other_entry.title, other_entry.description, entry.title, entry.slug)
-            updated_entries.append(other_entry)        
-        if updated_entries:
-            Entry.objects.bulk_update(updated_entries, ['description'])        
-        
+@shared_task
+def fail_entry_request(request, exc, traceback):
+    """
+    Called when a step of an entry request raises, with the job that the step was given.
+    Ends the job's flight and notifies it and its waiters, who would otherwise only
+    hear back once ENTRY_REQUEST_FLIGHT_TIMEOUT had passed.
+    """
+    job = request.args[0]
+    logger.error(f"[fail_entry_request] {request.task} failed for {job['query']}: {exc}")
+    if job['status'] == 'waiting':
+        return  # Notified by the leader
+    if not job['status']:
+        job.update(status='error', message="Something went wrong")
+    recipients = [(job['user_slug'], job['job_id'])]
+    if job['leader']:
+        recipients += land_flight(job)
+    send_job_notifications(job, recipients)
+
+@shared_task
+def validate_entry_request(job):
+    job['query'] = (job['query'] or '').strip().lower()
+    if not job['query']:
+        job.update(status='error', message="Missing query parameter")
+    elif len(job['query']) > 50:
+        job.update(status='error', message="This query is too long")
+    else:
+        job['slug'] = slugify(job['query'])
+    return job
+
+@shared_task
+def dedupe_entry_request(job):
+    if job['status']:
+        return job
+    if Entry.objects.filter(slug=job['slug']).exists():
+        job.update(status='exists', message="Entry already exists")
+    elif join_flight(job):
+        job['leader'] = True
+        # The previous leader may have saved the entry between the check above and landing
+        if Entry.objects.filter(slug=job['slug']).exists():
+            job.update(status='exists', message="Entry already exists")
+    else:
+        job.update(status='waiting', message="Entry is already being generated")
+    return job
+
+@shared_task
+def generate_entry_content(job):
+    if job['status']:
+        return job
+    stream = EntryStream(job['user_slug'], job['job_id']) if job['stream'] else None
+    try:
+        job['content'] = generate_entry(job['query'], on_chunk=stream)
     except Exception as e:
-        logger.error(f"[hyperlink_entry] Error for entry_pk={entry_pk}: {e}")
\ No newline at end of file
+        logger.error(f"[generate_entry_content] Error for {job['query']}: {e}")
+        job.update(status='error', message="Something went wrong")
+    finally:
+        if stream is not None:
+            stream.close()
+    return job
+
+@shared_task
+def format_entry_content(job):
+    if job['status']:
+        return job
+    job['content'] = format_entry(job['content'])
+    return job
+
+@shared_task
+def save_entry_content(job):
+    if job['status']:
+        return job
+    entry_data = {
+        "title": job['query'],
+        "description": job['content'],
+        "created_by": job['user_email'],
+        "updated_by": job['user_email']
+    }
+    serializer = CreateEntrySerializer(data=entry_data)
+    if serializer.is_valid():
+        try:
+            serializer.save()
+            job.update(slug=serializer.instance.slug, status='created', message=f"Entry for {job['query']} created successfully")
+        except Exception as e:
+            if Entry.objects.filter(slug=slugify(job['query'])).exists():
+                # Created outside the flight, e.g. by an admin or after the flight expired
+                job.update(status='exists', message="Entry already exists")
+            else:
+                logger.error(f"[save_entry_content] Exception on save: {e}")
+                job.update(status='error', message="Something went wrong")
+    else:
+        logger.error(f"{serializer.__class__.__name__} ERRORS: {serializer.errors}")
+        job.update(status='error', message="Something went wrong")
+    job['content'] = None  # Saved; no need to carry it through the rest of the chain
+    return job
+
+@shared_task
+def link_new_entry(job):
+    if job['status'] == 'created' and settings.ENTRY_LINK_MODE == 'stored':
+        schedule_hyperlinks(job['slug'])
+    return job
+
+def send_job_notifications(job, recipients):
+    """
+    Sends the result of the job to each (user slug, job id) in recipients.
+    """
+    for user_slug, job_id in recipients:
+        if job['status'] in ('created', 'exists'):
+            notify_user(
+                user_slug, "success", job['message'], jobId=job_id,
+                linkUrl=f"/entries/{job['slug']}", linkLabel="View"
+            )
+        else:
+            notify_user(user_slug, "error", job['message'] or "Something went wrong", jobId=job_id)
+
+@shared_task
+def notify_entry_request(job):
+    if job['status'] == 'waiting':
+        return {key: job[key] for key in ('job_id', 'slug', 'status', 'message')}  # Notified by the leader
+    recipients = [(job['user_slug'], job['job_id'])]
+    if job['leader']:
+        recipients += land_flight(job)
+    send_job_notifications(job, recipients)
+    return {key: job[key] for key in ('job_id', 'slug', 'status', 'message')}
+
+### Batches of entry requests ###
+# A batch is generated in ENTRY_BATCH_CONCURRENCY lanes that run in parallel, each generating its
+# topics one after the other. When every lane is done the whole batch is linked in one pass.
+
+def queue_entry_batch(topics, user, concurrency=None):
+    """
+    Queues the generation of an entry for each topic. Topics that are invalid, repeated or
+    already have an entry are left out, the last with a single query.
+    Returns the result of the batch (None if there was nothing to generate) and a dict
+    of the topics that were queued, already existed and were invalid.
+    """
+    concurrency = concurrency or settings.ENTRY_BATCH_CONCURRENCY
+    queries = {}  # slug: query
+    batch = {'queued': [], 'existing': [], 'invalid': []}
+    for topic in topics:
+        query = (topic or '').strip().lower()
+        if not query or len(query) > 50:
+            batch['invalid'].append(topic)
+        else:
+            queries.setdefault(slugify(query), query)
+    existing = set(Entry.objects.filter(slug__in=queries).values_list('slug', flat=True))
+    for slug, query in queries.items():
+        batch['existing' if slug in existing else 'queued'].append(query)
+    if not batch['queued']:
+        return None, batch
+
+    jobs = [new_entry_job(query, user, stream=False) for query in batch['queued']]
+    lanes = [
+        chain([generate_batch_entry.si(job) for job in jobs[lane::concurrency]])
+        for lane in range(min(concurrency, len(jobs)))
+    ]
+    batch_id = uuid.uuid4().hex
+    result = chord(lanes)(link_entry_batch.s(
+        batch_id, [job['query'] for job in jobs], user.slug
+    ).set(task_id=batch_id))
+    return result, batch
+
+@shared_task
+def generate_batch_entry(job):
+    """
+    One topic of a batch: the steps of an entry request, run in this task.
+    Linking is left to the end of the batch, and only requests that waited on this one are notified.
+    """
+    for step in (validate_entry_request, dedupe_entry_request, generate_entry_content, format_entry_content, save_entry_content):
+        try:
+            job = step(job)
+        except Exception as e:
+            # The rest of the lane and the batch's linking pass still run
+            logger.error(f"[generate_batch_entry] {step.name} failed for {job['query']}: {e}")
+            job.update(status='error', message="Something went wrong")
+            break
+    if job['leader']:
+        send_job_notifications(job, land_flight(job))
+    return {key: job[key] for key in ('job_id', 'slug', 'status', 'message')}
+
+@shared_task
+def link_entry_batch(results, batch_id, queries, user_slug):
+    """
+    Links the entries of the batch in one pass and lets the user know how it went.
+    """
+    slugs = [slugify(query) for query in queries]
+    created = list(Entry.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+    if created and settings.ENTRY_LINK_MODE == 'stored':
+        link_entries(created)
+    logger.info(f"[link_entry_batch] Generated {len(created)} of {len(slugs)} entries")
+    notify_user(
+        user_slug, "success" if len(created) == len(slugs) else "warning",
+        f"Generated {len(created)} of {len(slugs)} entries", jobId=batch_id
+    )
+    return {'batch_id': batch_id, 'entries': len(slugs), 'created': len(created)}
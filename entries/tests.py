@@ -1,3 +1,712 @@
-from django.test import TestCase
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from backend.celery import app as celery_app
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from openai import BadRequestError
+from rest_framework.test import APIClient
+from tags.models import TaggedItem
+from users.models import BaseUser
 
-# Create your tests here.
+from .generation import LocalGenerationBackend, generate_entry
+from .linker import get_corpus_linker, get_corpus_version
+from .models import Entry, EntryLink, EntryTerm
+from .openai_requests import TokenBucketLimiter, request_new_entry
+from .search import InvertedIndex, TitleTrie, get_title_trie
+from .serializers import FullEntrySerializer
+from .tasks import (
+    FLIGHT_KEY, FLIGHT_MUTEX_KEY, flight_mutex, generate_batch_entry, hyperlink_pending_entries, join_flight,
+    link_entries, new_entry_job, queue_entry_request, relink_chunk, schedule_hyperlinks, unlink_entry,
+)
+from .utils import format_entry
+
+FORMAT_ENTRY_CORPUS = Path(__file__).resolve().parent / "test_data" / "format_entry"
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def legacy_format_entry(text: str) -> str:
+    """
+    The original chain of re.sub passes that format_entry replaces, kept as the reference implementation.
+    """
+    text = re.sub(r"\[(.*?)\]\((.*?)\)", r'<a href="\2" _blank>\1</a>', text)
+    text = re.sub(r"((- )?\*{2})(.*?)(\*{2})", r"<strong>\3</strong>", text)
+    text = re.sub("\n\n", "\n", text)
+    text = text.strip()
+    text = re.sub("(.*?)(<h3>)", r"\2", text, 1)
+    text = re.sub(r"(^|\s+)##\s*(\d+\.)?\s*(.*?)\n", r"<h3>\3</h3>", text)
+    text = re.sub("(</h3>)(.*?)(<h3>)", r"\1<p>\2</p>\3", text)
+    text = re.sub("\n+(- )?", r"<br>", text)
+    text = re.sub(r"(>)\s*-\s*(<)", r"\1\2", text)
+    text = re.sub("(<br>){2,}", r"<br>", text)
+    text = re.sub("<p>(<br>)?</p>", r"", text)
+    return text
+
+
+def generate_response(seed, sections=12):
+    """
+    A markdown response shaped like the ones returned for new entries.
+    """
+    generator = random.Random(seed)
+    words = "the stream broker partition consumer offset log cluster topic message latency api client server".split()
+
+    def sentence(length=None):
+        return " ".join(generator.choice(words) for _ in range(length or generator.randint(8, 30))).capitalize() + "."
+
+    parts = ["Sure! Here is an overview of the topic.\n\n"]
+    for number in range(1, sections + 1):
+        parts.append(f"## {number}. {sentence(3)}\n\n")
+        for _ in range(generator.randint(2, 6)):
+            if generator.random() < 0.3:
+                parts += [f"- **{sentence(2)}**: {sentence()}\n" for _ in range(generator.randint(2, 6))]
+                parts.append("\n")
+            elif generator.random() < 0.2:
+                parts.append(f"- [{sentence(2)}](https://example.com/{generator.randint(1, 999)})\n")
+            else:
+                parts.append(" ".join(sentence() for _ in range(generator.randint(2, 8))) + "\n\n")
+    return "".join(parts)
+
+
+class FormatEntryTests(SimpleTestCase):
+    def test_golden_corpus(self):
+        sources = sorted(FORMAT_ENTRY_CORPUS.glob("*.md"))
+        self.assertTrue(sources)
+        for source in sources:
+            with self.subTest(source.name):
+                text = source.read_text()
+                expected = source.with_suffix(".html").read_text()
+                self.assertEqual(format_entry(text), expected)
+                self.assertEqual(legacy_format_entry(text), expected)
+
+    def test_matches_legacy_on_generated_responses(self):
+        for seed in range(25):
+            with self.subTest(seed=seed):
+                text = generate_response(seed)
+                self.assertEqual(format_entry(text), legacy_format_entry(text))
+
+    def test_matches_legacy_on_fragments(self):
+        fragments = [
+            "## ", "### ", "##", "#", "- ", "-", "**", "*", "[", "](", ")", "\n", "\n\n", "\n\n\n", " ", "\t",
+            "word", "1.", "<h3>", "</h3>", "<p>", "</p>", "<br>", "<li>", ">", "<",
+        ]
+        generator = random.Random(0)
+        for _ in range(2000):
+            text = "".join(generator.choice(fragments) for _ in range(generator.randint(0, 40)))
+            self.assertEqual(format_entry(text), legacy_format_entry(text), repr(text))
+
+    @skipUnless(os.getenv('BENCHMARK'), "Set BENCHMARK=1 to compare format_entry with the legacy implementation")
+    def test_benchmark(self):
+        for sections in (4, 12, 40):
+            text = generate_response(sections, sections=sections)
+            timings = {}
+            for name, function in (("legacy", legacy_format_entry), ("format_entry", format_entry)):
+                start = time.perf_counter()
+                for _ in range(5):
+                    function(text)
+                timings[name] = (time.perf_counter() - start) / 5 * 1000
+            print(
+                f"\n{len(text)} characters: legacy {timings['legacy']:.2f} ms, "
+                f"format_entry {timings['format_entry']:.2f} ms"
+            )
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    A local OpenAI-compatible chat completions endpoint. Responds to each request with the next
+    status in `failures`, then with `content`, streamed if the request asks for it.
+    """
+    daemon_threads = True
+
+    def __init__(self, content="## 1. Intro\nA fake response\n", failures=()):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.content = content
+        self.failures = list(failures)
+        self.requests = []  # (client port, request body) of every request received
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keeps connections open, as the API does
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.client_address[1], body))
+        if self.server.failures:
+            status = self.server.failures.pop(0)
+            self.send_json(status, {"error": {"message": "Fake error", "type": "fake"}}, [("Retry-After", "0")])
+            return
+        content = self.server.content
+        usage = {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30}
+        if not body.get("stream"):
+            self.send_json(200, {
+                "id": "fake", "object": "chat.completion", "created": 0, "model": body["model"], "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        events = [
+            {"choices": [{"index": 0, "delta": {"content": content[i:i + 5]}, "finish_reason": None}]}
+            for i in range(0, len(content), 5)
+        ]
+        events.append({"choices": [], "usage": usage})
+        for event in events:
+            event.update(id="fake", object="chat.completion.chunk", created=0, model=body["model"])
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+@override_settings(
+    OPENAI_API_KEY="test", OPENAI_MODEL_NAME="test-model", ENTRY_RESPONSE_CACHE=None,
+    OPENAI_BACKOFF_BASE=0.01, OPENAI_MAX_RETRIES=3,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class RequestNewEntryTests(SimpleTestCase):
+    def request(self, server, query="kafka", **kwargs):
+        with self.settings(OPENAI_BASE_URL=server.base_url):
+            return request_new_entry(query, **kwargs)
+
+    def tearDown(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_reuses_connection(self):
+        server = FakeOpenAIServer()
+        self.addCleanup(server.shutdown)
+        self.assertEqual(self.request(server), server.content)
+        self.assertEqual(self.request(server), server.content)
+        self.assertEqual(len({port for port, _ in server.requests}), 1)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        server = FakeOpenAIServer(failures=[429, 503])
+        self.addCleanup(server.shutdown)
+        self.assertEqual(self.request(server), server.content)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_does_not_retry_bad_requests(self):
+        server = FakeOpenAIServer(failures=[400])
+        self.addCleanup(server.shutdown)
+        with self.assertRaises(BadRequestError):
+            self.request(server)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_gives_up_after_max_retries(self):
+        server = FakeOpenAIServer(failures=[429] * 10)
+        self.addCleanup(server.shutdown)
+        with self.assertRaises(Exception):
+            self.request(server)
+        self.assertEqual(len(server.requests), 4)
+
+    def test_streams_content(self):
+        server = FakeOpenAIServer()
+        self.addCleanup(server.shutdown)
+        chunks = []
+        self.assertEqual(self.request(server, on_chunk=chunks.append), server.content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), server.content)
+        self.assertTrue(server.requests[0][1]["stream"])
+
+    def test_limiter_holds_requests_to_rate(self):
+        limiter = TokenBucketLimiter("test", {"requests": 60, "tokens": 1200})
+        for _ in range(3):
+            self.assertEqual(limiter.try_acquire({"requests": 1, "tokens": 400}), 0)
+        wait = limiter.try_acquire({"requests": 1, "tokens": 400})
+        self.assertAlmostEqual(wait, 20, delta=0.5)  # 400 tokens at 1200 a minute
+        limiter.adjust({"tokens": -400})  # Refunded, e.g. when the request failed
+        self.assertEqual(limiter.try_acquire({"requests": 1, "tokens": 400}), 0)
+
+
+@override_settings(
+    ENTRY_GENERATION_BACKEND="entries.generation.LocalGenerationBackend",
+    ENTRY_LOCAL_GENERATION={"SIZE": 3000, "LATENCY": 0, "CHUNK_SIZE": 25, "CHUNK_INTERVAL": 0},
+)
+class LocalGenerationBackendTests(SimpleTestCase):
+    def test_content_is_deterministic(self):
+        content = generate_entry("kafka")
+        self.assertEqual(generate_entry("kafka"), content)
+        self.assertNotEqual(generate_entry("redis"), content)
+        self.assertTrue(content.startswith("<h3>Introduction</h3>"))
+
+    def test_content_size(self):
+        for size in (3000, 20000):
+            with self.subTest(size=size), self.settings(ENTRY_LOCAL_GENERATION={"SIZE": size}):
+                length = len(generate_entry("kafka"))
+                self.assertGreaterEqual(length, size)
+                self.assertLess(length, size * 1.5)
+
+    def test_streams_chunks(self):
+        chunks = []
+        content = generate_entry("kafka", on_chunk=chunks.append)
+        self.assertEqual("".join(chunks), content)
+        self.assertTrue(all(len(chunk) == 25 for chunk in chunks[:-1]))
+
+    def test_latency(self):
+        with self.settings(ENTRY_LOCAL_GENERATION={"SIZE": 500, "LATENCY": 0.05, "CHUNK_SIZE": 100, "CHUNK_INTERVAL": 0.01}):
+            start = time.perf_counter()
+            content = LocalGenerationBackend().generate("kafka")
+            self.assertGreaterEqual(time.perf_counter() - start, 0.05 + 0.01 * (len(content) // 100))
+
+
+class TitleTrieTests(SimpleTestCase):
+    titles = [
+        ("Kafka", "kafka"), ("Kafka Streams", "kafka-streams"), ("Apache Kafka", "apache-kafka"),
+        ("Kotlin", "kotlin"), ("Event Sourcing", "event-sourcing"),
+    ]
+
+    def suggest(self, prefix, **kwargs):
+        return [slug for title, slug in TitleTrie(self.titles).suggest(prefix, **kwargs)]
+
+    def test_prefix(self):
+        self.assertEqual(self.suggest("KAF", max_edits=0), ["kafka", "kafka-streams", "apache-kafka"])
+        self.assertEqual(self.suggest("k", max_edits=0, limit=2), ["kafka", "kotlin"])
+
+    def test_later_words(self):
+        self.assertEqual(self.suggest("sourc", max_edits=0), ["event-sourcing"])
+        self.assertEqual(self.suggest("apache  k", max_edits=0), ["apache-kafka"])
+
+    def test_typos(self):
+        self.assertEqual(self.suggest("kafak", max_edits=0), [])
+        self.assertEqual(self.suggest("kafak")[:3], ["kafka", "kafka-streams", "apache-kafka"])
+        self.assertEqual(self.suggest("evnt so"), ["event-sourcing"])
+
+
+class InvertedIndexTests(SimpleTestCase):
+    entries = [
+        ("kafka", "Kafka", "<p>Kafka is a distributed log of <em>events</em>.</p>"),
+        ("redis", "Redis", "<p>Redis is an in-memory store, often used beside Kafka.</p>"),
+        ("stream-processing", "Stream Processing", "<p>Processing streams of events from Kafka with Flink.</p>"),
+    ]
+
+    def build(self):
+        index = InvertedIndex()
+        for position, (slug, title, description) in enumerate(self.entries):
+            index.add(slug, title, description, updated=float(position))
+        return index
+
+    def slugs(self, index, query):
+        return [slug for slug, score in index.search(query)]
+
+    def test_ranking(self):
+        index = self.build()
+        self.assertEqual(self.slugs(index, "kafka"), ["kafka", "redis", "stream-processing"])
+        self.assertEqual(self.slugs(index, "Events KAFKA"), ["kafka", "stream-processing"])
+        self.assertEqual(self.slugs(index, "kafka postgres"), [])
+        self.assertEqual(self.slugs(index, "em"), [])
+
+    def test_updates(self):
+        index = self.build()
+        index.add("redis", "Redis", "<p>A key-value store.</p>")
+        index.remove("kafka")
+        self.assertEqual(self.slugs(index, "kafka"), ["stream-processing"])
+        self.assertEqual(self.slugs(index, "store"), ["redis"])
+        index.compact()
+        self.assertEqual(index.dead, 0)
+        self.assertEqual(self.slugs(index, "kafka"), ["stream-processing"])
+
+    def test_snapshot(self):
+        index = self.build()
+        index.remove("redis")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.bin")
+            index.save(path)
+            loaded = InvertedIndex.load(path)
+            index.compact()
+            self.assertEqual(loaded.search("kafka events"), index.search("kafka events"))
+            self.assertEqual(loaded.watermark, 2.0)
+            loaded.add("flink", "Flink", "<p>Streams of events.</p>", updated=3.0)
+            self.assertEqual(self.slugs(loaded, "events"), ["flink", "kafka", "stream-processing"])
+
+
+@override_settings(ENTRY_LINK_MODE="stored", CACHES=LOCMEM_CACHES)
+class EntryTestCase(TestCase):
+    """
+    Entries created by a test user, with the default cache kept in memory.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = BaseUser.objects.create_user(email="tester@example.com", username="tester", password="password")
+
+    def tearDown(self):
+        cache.clear()
+
+    def create_entry(self, title, description=""):
+        return Entry.objects.create(title=title, description=description, created_by=self.user, updated_by=self.user)
+
+    def description(self, slug):
+        return Entry.objects.get(slug=slug).description
+
+
+class LinkEntriesTests(EntryTestCase):
+    def test_links_batch_both_ways(self):
+        self.create_entry("Redis", "<p>Redis is often used beside Kafka.</p>")
+        self.create_entry("Stream Processing", "<p>Processing events from kafka.</p>")
+        self.create_entry("Kafka", "<p>Kafka is a log. Compare Redis and stream processing.</p>")
+        self.assertEqual(link_entries(["kafka"]), 3)
+        self.assertEqual(
+            self.description("kafka"),
+            '<p>Kafka is a log. Compare <a href="/entries/redis">Redis</a> and '
+            '<a href="/entries/stream-processing">stream processing</a>.</p>'
+        )
+        self.assertEqual(self.description("redis"), '<p>Redis is often used beside <a href="/entries/kafka">Kafka</a>.</p>')
+        self.assertEqual(self.description("stream-processing"), '<p>Processing events from <a href="/entries/kafka">kafka</a>.</p>')
+
+    def test_leaves_existing_links_and_other_words(self):
+        self.create_entry("Kafka", "<p>A log.</p>")
+        self.create_entry("Redis", '<p>See <a href="/entries/kafka">Kafka</a> and Kafkaesque designs.</p>')
+        self.assertEqual(link_entries(["kafka"]), 0)
+        self.assertEqual(self.description("redis"), '<p>See <a href="/entries/kafka">Kafka</a> and Kafkaesque designs.</p>')
+
+    def test_missing_entries(self):
+        self.assertEqual(link_entries(["missing"]), 0)
+
+
+class EntryTermTests(EntryTestCase):
+    def terms(self, slug):
+        return set(EntryTerm.objects.filter(entry=slug).values_list("term", flat=True))
+
+    def mentioning(self, title):
+        return set(EntryTerm.objects.mentioning(title).values_list("slug", flat=True))
+
+    def test_save_indexes_terms(self):
+        entry = self.create_entry("Kafka", "<p>A <strong>distributed</strong> log, a log.</p>")
+        self.assertEqual(self.terms("kafka"), {"a", "distributed", "log"})
+        entry.description = "<p>A replicated log.</p>"
+        entry.save()
+        self.assertEqual(self.terms("kafka"), {"a", "replicated", "log"})
+
+    def test_saving_other_fields_keeps_terms(self):
+        entry = self.create_entry("Kafka", "<p>A log.</p>")
+        Entry.objects.filter(slug="kafka").update(description="<p>Streams.</p>")
+        entry.save(update_fields=["title"])
+        self.assertEqual(self.terms("kafka"), {"a", "log"})
+
+    def test_mentioning(self):
+        self.create_entry("Redis", "<p>Often used beside Apache Kafka.</p>")
+        self.create_entry("Flink", "<p>Reads streams from kafka.</p>")
+        self.create_entry("Postgres", "<p>A database.</p>")
+        self.assertEqual(self.mentioning("Kafka"), {"redis", "flink"})
+        self.assertEqual(self.mentioning("Apache Kafka"), {"redis"})
+        self.assertEqual(self.mentioning("Kafka Connect"), set())
+        self.assertEqual(self.mentioning("..."), {"redis", "flink", "postgres"})
+
+
+class EntryLinkTests(EntryTestCase):
+    def setUp(self):
+        self.create_entry("Kafka", "<p>A log.</p>")
+        self.create_entry("Redis", "<p>A store.</p>")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def links(self):
+        return set(EntryLink.objects.values_list("source", "target", "anchor_text"))
+
+    def test_save_records_links(self):
+        entry = self.create_entry(
+            "Flink",
+            '<p>Reads <a href="/entries/kafka">Apache <em>Kafka</em></a>, '
+            '<a href="/entries/kafka/">kafka</a>, <a href="/entries/missing">nothing</a> and '
+            '<a href="/entries/flink">itself</a>.</p>'
+        )
+        self.assertEqual(self.links(), {("flink", "kafka", "Apache Kafka")})
+        entry.description = '<p>Beside <a href="/entries/redis">Redis</a>.</p>'
+        entry.save()
+        self.assertEqual(self.links(), {("flink", "redis", "Redis")})
+
+    def test_links_endpoints(self):
+        self.create_entry("Flink", '<p><a href="/entries/kafka">Kafka</a> and <a href="/entries/redis">Redis</a>.</p>')
+        self.create_entry("Spark", '<p><a href="/entries/kafka">Kafka</a>.</p>')
+        response = self.client.get("/api/entries/kafka/backlinks/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([link["source"] for link in response.data["results"]], ["flink", "spark"])
+        self.assertEqual(response.data["results"][0]["source_title"], "Flink")
+        response = self.client.get("/api/entries/flink/links/")
+        self.assertEqual([link["target"] for link in response.data["results"]], ["kafka", "redis"])
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(self.client.get("/api/entries/missing/backlinks/").status_code, 404)
+
+    def test_links_endpoints_in_render_mode(self):
+        with self.settings(ENTRY_LINK_MODE="render"):
+            for url in ("/api/entries/kafka/backlinks/", "/api/entries/kafka/links/"):
+                self.assertEqual(self.client.get(url).status_code, 501)
+
+    def test_delete_unlinks_sources(self):
+        self.create_entry("Flink", '<p>Reads <a href="/entries/kafka">Kafka</a> into <a href="/entries/redis">Redis</a>.</p>')
+        with mock.patch.object(unlink_entry, "delay", side_effect=unlink_entry) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                Entry.objects.get(slug="kafka").delete()
+        delay.assert_called_once_with("kafka", ["flink"])
+        self.assertEqual(self.description("flink"), '<p>Reads Kafka into <a href="/entries/redis">Redis</a>.</p>')
+        self.assertEqual(self.links(), {("flink", "redis", "Redis")})
+
+
+@override_settings(ENTRY_LINK_BATCH_WINDOW=5, ENTRY_LINK_BATCH_SIZE=2)
+class HyperlinkPendingEntriesTests(EntryTestCase):
+    def setUp(self):
+        self.create_entry("Kafka", "<p>A log, often beside Redis.</p>")
+        self.create_entry("Redis", "<p>A store.</p>")
+        self.create_entry("Flink", "<p>Reads Kafka.</p>")
+        patcher = mock.patch.object(hyperlink_pending_entries, "apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pending(self):
+        return set(Entry.objects.filter(link_pending=True).values_list("slug", flat=True))
+
+    def test_schedules_coalesce(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_hyperlinks("kafka")
+            schedule_hyperlinks("redis")
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_hyperlinks("flink")
+        self.apply_async.assert_called_once_with(countdown=5)
+        self.assertEqual(self.pending(), {"kafka", "redis", "flink"})
+
+    def test_rolled_back_schedule_does_not_hold_off_passes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    schedule_hyperlinks("kafka")
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.apply_async.assert_not_called()
+        self.assertEqual(self.pending(), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_hyperlinks("redis")
+        self.apply_async.assert_called_once_with(countdown=5)
+
+    def test_links_pending_entries_in_batches(self):
+        Entry.objects.update(link_pending=True)
+        with mock.patch.object(hyperlink_pending_entries, "delay") as delay:
+            hyperlink_pending_entries.apply().get()
+        delay.assert_called_once_with()  # The batch was full, so there may be more
+        self.assertEqual(self.pending(), {"redis"})
+        self.assertEqual(self.description("flink"), '<p>Reads <a href="/entries/kafka">Kafka</a>.</p>')
+        self.assertEqual(self.description("kafka"), '<p>A log, often beside <a href="/entries/redis">Redis</a>.</p>')
+        self.assertEqual(hyperlink_pending_entries.apply().get(), 0)  # Already linked to by kafka
+        self.assertEqual(self.pending(), set())
+
+    def test_failed_pass_is_retried(self):
+        Entry.objects.filter(slug="flink").update(link_pending=True)
+        with mock.patch("entries.tasks.link_entries", side_effect=[RuntimeError("Lost the database"), 1]) as link:
+            self.assertEqual(hyperlink_pending_entries.apply().get(), 1)
+        self.assertEqual(link.call_args_list, [mock.call(["flink"])] * 2)
+        self.assertEqual(self.pending(), set())
+
+    def test_gives_entries_back_after_retries(self):
+        Entry.objects.filter(slug="flink").update(link_pending=True)
+        with mock.patch("entries.tasks.link_entries", side_effect=RuntimeError("Lost the database")) as link:
+            with self.assertRaises(RuntimeError):
+                hyperlink_pending_entries.apply().get()
+        self.assertEqual(link.call_count, hyperlink_pending_entries.max_retries + 1)
+        self.assertEqual(self.pending(), {"flink"})
+
+
+class RelinkChunkTests(EntryTestCase):
+    def setUp(self):
+        self.create_entry("Kafka", "<p>A log.</p>")
+        self.create_entry("Redis", "<p>A store, often beside Kafka.</p>")
+        self.create_entry("Flink", "<p>Reads Kafka into Redis.</p>")
+        link_entries(["kafka", "redis", "flink"])
+
+    def links(self):
+        return set(EntryLink.objects.values_list("source", "target"))
+
+    def test_relinking_unchanged_corpus_keeps_links(self):
+        links = self.links()
+        self.assertEqual(links, {("redis", "kafka"), ("flink", "kafka"), ("flink", "redis")})
+        self.assertEqual(relink_chunk("a", "z"), {"entries": 3, "updated": 0, "links": 3})
+        self.assertEqual(self.links(), links)
+
+    def test_relinking_replaces_stale_links(self):
+        Entry.objects.filter(slug="flink").update(
+            description='<p>Reads <a href="/entries/redis">Kafka</a> into Redis.</p>'
+        )
+        self.assertEqual(relink_chunk("flink", "flink"), {"entries": 1, "updated": 1, "links": 2})
+        self.assertEqual(
+            self.description("flink"),
+            '<p>Reads <a href="/entries/kafka">Kafka</a> into <a href="/entries/redis">Redis</a>.</p>'
+        )
+        self.assertEqual(
+            set(EntryLink.objects.filter(source="flink").values_list("target", "anchor_text")),
+            {("kafka", "Kafka"), ("redis", "Redis")}
+        )
+
+    def test_relink_entries_command(self):
+        Entry.objects.filter(slug="flink").update(description="<p>Reads Kafka into Redis.</p>")
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+        output = StringIO()
+        call_command("relink_entries", chunk_size=2, stdout=output)
+        self.assertIn("Relinked 3 entries: 1 changed, 3 links", output.getvalue())
+        self.assertEqual(
+            self.description("flink"),
+            '<p>Reads <a href="/entries/kafka">Kafka</a> into <a href="/entries/redis">Redis</a>.</p>'
+        )
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class EntryRequestTests(EntryTestCase):
+    def setUp(self):
+        self.waiter = BaseUser.objects.create_user(email="waiter@example.com", username="waiter", password="password")
+        patcher = mock.patch("entries.tasks.notify_user")
+        self.notify_user = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def notifications(self):
+        return [(user_slug, type_, extra["jobId"]) for (user_slug, type_, message), extra in self.notify_user.call_args_list]
+
+    def generate_with_waiter(self, query, on_chunk=None):
+        # Another request for the same entry arrives while it is generated
+        self.waiting_job = new_entry_job(query, self.waiter)
+        self.waiting_job["slug"] = "kafka"
+        self.assertFalse(join_flight(self.waiting_job))
+        return "## 1. Kafka\nA log.\n"
+
+    def test_failed_step_lands_flight(self):
+        with mock.patch("entries.tasks.generate_entry", side_effect=self.generate_with_waiter), \
+                mock.patch("entries.tasks.format_entry", side_effect=RuntimeError("Bad content")):
+            with self.assertRaises(RuntimeError):
+                queue_entry_request("kafka", self.user, eager=True)
+        self.assertEqual(
+            [(user_slug, type_) for user_slug, type_, job_id in self.notifications()],
+            [("tester", "error"), ("waiter", "error")]
+        )
+        self.assertEqual(self.notifications()[1][2], self.waiting_job["job_id"])
+        self.assertIsNone(cache.get(FLIGHT_KEY.format(slug="kafka")))
+        self.assertFalse(Entry.objects.filter(slug="kafka").exists())
+
+    def test_failed_batch_entry_lands_flight(self):
+        with mock.patch("entries.tasks.generate_entry", side_effect=self.generate_with_waiter), \
+                mock.patch("entries.tasks.format_entry", side_effect=RuntimeError("Bad content")):
+            result = generate_batch_entry(new_entry_job("kafka", self.user, stream=False))
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(self.notifications(), [("waiter", "error", self.waiting_job["job_id"])])
+        self.assertIsNone(cache.get(FLIGHT_KEY.format(slug="kafka")))
+
+    def test_created(self):
+        with mock.patch("entries.tasks.generate_entry", side_effect=self.generate_with_waiter), \
+                mock.patch("entries.tasks.schedule_hyperlinks"):
+            result = queue_entry_request("kafka", self.user, eager=True).get()
+        self.assertEqual(result["status"], "created")
+        self.assertEqual(self.notifications(), [
+            ("tester", "success", result["job_id"]), ("waiter", "success", self.waiting_job["job_id"])
+        ])
+        self.assertTrue(Entry.objects.filter(slug="kafka").exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FlightMutexTests(SimpleTestCase):
+    key = FLIGHT_MUTEX_KEY.format(slug="kafka")
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_releases_only_its_own_token(self):
+        with flight_mutex("kafka"):
+            self.assertIsNotNone(cache.get(self.key))
+        self.assertIsNone(cache.get(self.key))
+        with flight_mutex("kafka"):
+            cache.set(self.key, "other")  # Expired and taken by another worker
+        self.assertEqual(cache.get(self.key), "other")
+
+    def test_times_out(self):
+        cache.set(self.key, "other")
+        with mock.patch("entries.tasks.FLIGHT_MUTEX_TIMEOUT", 0.1):
+            with self.assertRaises(TimeoutError):
+                with flight_mutex("kafka"):
+                    pass
+        self.assertEqual(cache.get(self.key), "other")
+
+
+class EntryListCacheTests(EntryTestCase):
+    def setUp(self):
+        self.create_entry("Kafka", "<p>A log.</p>")
+        self.create_entry("Redis", "<p>A store.</p>")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get("/api/entries/", **headers)
+
+    def slugs(self, response):
+        return [entry["slug"] for entry in response.json()]
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(self.slugs(response), ["kafka", "redis"])
+        self.assertEqual(self.get(response["ETag"]).status_code, 304)
+
+    def test_changes_without_save(self):
+        changes = [
+            lambda: Entry.objects.filter(slug="redis").delete(),
+            lambda: Entry.objects.bulk_create([Entry(slug="flink", title="Flink", created_by=self.user, updated_by=self.user)]),
+            lambda: Entry.objects.filter(slug="flink").update(title="Apache Flink"),
+        ]
+        expected = [["kafka"], ["flink", "kafka"], ["flink", "kafka"]]
+        etag = self.get()["ETag"]
+        for change, slugs in zip(changes, expected):
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.get(etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.slugs(response), slugs)
+            etag = response["ETag"]
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}, "corpus_version": LOCMEM_CACHES["default"]},
+        ENTRY_CORPUS_VERSION_CACHE="corpus_version",
+    )
+    def test_version_kept_beside_a_dummy_cache(self):
+        version = get_corpus_version()
+        self.assertIsNotNone(version)
+        self.assertIs(get_corpus_linker(), get_corpus_linker())
+        self.assertIs(get_title_trie(), get_title_trie())
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_entry("Flink")
+        self.assertGreater(get_corpus_version(), version)
+        self.assertEqual(self.slugs(self.get(etag)), ["flink", "kafka", "redis"])
+
+
+class FullEntrySerializerTests(EntryTestCase):
+    def test_fields(self):
+        self.create_entry("Kafka", "<p>A log.</p>")
+        TaggedItem.objects.bulk_tag(Entry.objects.all(), ["Streaming", "Logs"], self.user)
+        with self.assertNumQueries(2):
+            data = FullEntrySerializer(Entry.objects.with_tags(), many=True).data[0]
+        self.assertEqual(data["tags"], ["Logs", "Streaming"])
+        self.assertNotIn("link_pending", data)
+        self.assertNotIn("search_vector", data)
@@ -1,5 +1,5 @@
 from django.urls import path, re_path
-from .views import CreateEntry, ViewEntry, EntryList, RequestNewEntry
+from .views import CreateEntry, ViewEntry, EntryList, RequestNewEntry, GenerateEntries, EntrySuggest, EntryBacklinks, EntryOutboundLinks
 
 urlpatterns = [
     # path('entries/', EntryList.as_view(), name='entries'),
@@ -10,6 +10,10 @@ api_urlpatterns = [
     path('api/entries/', EntryList.as_view(), name='api entries'),
     path('api/entries/create/', CreateEntry.as_view(), name='api create entry'),
     path('api/entries/request-new/', RequestNewEntry.as_view(), name='api entries request-new'),
+    path('api/entries/generate/', GenerateEntries.as_view(), name='api entries generate'),
+    path('api/entries/suggest/', EntrySuggest.as_view(), name='api entries suggest'),
+    re_path('api/entries/(?P<slug>[\w\-]+)/backlinks/$', EntryBacklinks.as_view(), name='api entry backlinks'),
+    re_path('api/entries/(?P<slug>[\w\-]+)/links/$', EntryOutboundLinks.as_view(), name='api entry links'),
     re_path('api/entries/(?P<slug>[\w\-]+)/$', ViewEntry.as_view(), name='api view entry'),
 ]
 
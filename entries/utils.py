@@ -1,24 +1,126 @@
+import csv
+import html
+import json
 import re
 
+MARKDOWN_LINK_PATTERN = re.compile(r"\[(.*?)\]\((.*?)\)")
+BOLD_PATTERN = re.compile(r"(?:- )?\*{2}(.*?)\*{2}")
+HEADING_MARK_PATTERN = re.compile(r"(?<!\S)##")
+HEADING_PATTERN = re.compile(r"\s*(?:\d+\.)?\s*(.*?)\n")
+BLOCK_PATTERN = re.compile(r"</h3>|\n+(?:- )?")
+DASH_PATTERN = re.compile(r">\s*-\s*<")
+BREAKS_PATTERN = re.compile(r"(?:<br>){2,}")
+EMPTY_PARAGRAPH_PATTERN = re.compile(r"<p>(?:<br>)?</p>")
+
 def format_entry(text: str) -> str:
     """
-    Cleans and formats the given text to conform to the Entry model
+    Cleans and formats the given text to conform to the Entry model.
+    Markdown links and bold text become HTML, anything before the first <h3> on its line is dropped,
+    '##' headings become <h3>, single-line sections become paragraphs and newlines become <br>.
+
+    The block structure is built by a single left-to-right scan, so the cost is linear in the
+    length of the text; the output is identical to the original chain of re.sub passes
+    (see the golden corpus in entries/test_data/format_entry).
     """
     # Links
-    text = re.sub(r"\[(.*?)\]\((.*?)\)", r'<a href="\2" _blank>\1</a>', text)
+    text = MARKDOWN_LINK_PATTERN.sub(r'<a href="\2" _blank>\1</a>', text)
     # Bold
-    text = re.sub(r"((- )?\*{2})(.*?)(\*{2})", r"<strong>\3</strong>", text)
+    text = BOLD_PATTERN.sub(r"<strong>\1</strong>", text)
     # Condense
-    text = re.sub("\n\n", "\n", text)
+    text = text.replace("\n\n", "\n").strip()
     # Beginning
-    text = text.strip()
-    text = re.sub("(.*?)(<h3>)", r"\2", text, 1)
-    # Headers
-    text = re.sub("(^|\s+)##\s*(\d+\.)?\s*(.*?)\n", r"<h3>\3</h3>", text)
-    # Body
-    text = re.sub("(</h3>)(.*?)(<h3>)", r"\1<p>\2</p>\3", text)
-    text = re.sub("\n+(- )?", r"<br>", text) # duplicate newlines
-    text = re.sub("(>)\s*-\s*(<)", r"\1\2", text) # exposed dashes
-    text = re.sub("(<br>){2,}", r"<br>", text) # duplicate line breaks
-    text = re.sub("<p>(<br>)?</p>", r"", text) # empty paragraphs
-    return text
\ No newline at end of file
+    first_heading = text.find("<h3>")
+    if first_heading > 0:
+        line_start = text.rfind("\n", 0, first_heading) + 1
+        text = text[:line_start] + text[first_heading:]
+    # Headers and body
+    text = _format_blocks(_format_headings(text))
+    text = DASH_PATTERN.sub("><", text) # exposed dashes
+    text = BREAKS_PATTERN.sub("<br>", text) # duplicate line breaks
+    return EMPTY_PARAGRAPH_PATTERN.sub("", text) # empty paragraphs
+
+def _format_headings(text: str) -> str:
+    """
+    Replaces '##' headings, together with the whitespace before them and the rest of their line, with <h3>.
+    A '##' only starts a heading at the beginning of the text or after whitespace that was not
+    consumed by the previous heading.
+    """
+    pieces = []
+    position = 0
+    mark = HEADING_MARK_PATTERN.search(text)
+    while mark:
+        start = mark.start()
+        heading = HEADING_PATTERN.match(text, start + 2) if start == 0 or start > position else None
+        if heading:
+            pieces.append(text[position:start].rstrip())
+            pieces.append(f"<h3>{heading.group(1)}</h3>")
+            position = heading.end()
+            mark = HEADING_MARK_PATTERN.search(text, position)
+        else:
+            mark = HEADING_MARK_PATTERN.search(text, start + 1)
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+def _format_blocks(text: str) -> str:
+    """
+    Wraps text between a </h3> and an <h3> on the same line in a paragraph,
+    and replaces runs of newlines (and a following list dash) with <br>.
+    """
+    pieces = []
+    position = 0
+    token = BLOCK_PATTERN.search(text)
+    while token:
+        start, end = token.span()
+        if token.group() == "</h3>":
+            line_end = text.find("\n", end)
+            next_heading = text.find("<h3>", end, len(text) if line_end == -1 else line_end)
+            if next_heading != -1:
+                pieces.append(text[position:start])
+                pieces.append(f"</h3><p>{text[end:next_heading]}</p><h3>")
+                position = next_heading + 4
+                token = BLOCK_PATTERN.search(text, position)
+                continue
+        else:
+            pieces.append(text[position:start])
+            pieces.append("<br>")
+            position = end
+        token = BLOCK_PATTERN.search(text, end)
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+TAG_PATTERN = re.compile(r"<[^>]*>")
+TERM_PATTERN = re.compile(r"\w+")
+
+def strip_html(text: str) -> str:
+    """
+    Returns the readable text of an HTML document.
+    Tags are replaced with whitespace so that words in adjacent elements stay apart.
+    """
+    return html.unescape(TAG_PATTERN.sub(" ", text))
+
+def tokenise(text: str, max_length: int = 50) -> set:
+    """
+    Returns the set of normalised terms (lowercase words) in a piece of plain text.
+    Terms are truncated to max_length so that they fit the EntryTerm table.
+    """
+    return {term[:max_length] for term in TERM_PATTERN.findall(text.lower())}
+
+def read_topics(lines, file_name: str) -> list:
+    """
+    Reads a list of topics from the lines of a file, by its extension: a CSV file with a 'topic'
+    column, or a JSONL file of topics or of objects with a 'topic' key.
+    Raises ValueError if the file can't be read as either.
+    """
+    if file_name.lower().endswith('.csv'):
+        reader = csv.DictReader(lines)
+        if 'topic' not in (reader.fieldnames or []):
+            raise ValueError("CSV files need a 'topic' column")
+        return [row['topic'] for row in reader]
+    if file_name.lower().endswith('.jsonl'):
+        topics = []
+        for line in lines:
+            if line.strip():
+                topic = json.loads(line)
+                topics.append(topic.get('topic') if isinstance(topic, dict) else topic)
+        return [topic for topic in topics if isinstance(topic, str)]
+    raise ValueError(f"Can't read topics from {file_name}; expected a .csv or .jsonl file")
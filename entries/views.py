@@ -1,17 +1,20 @@
-import json
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from django.db.models import Q
-from django.utils.text import slugify
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from backend.base_views import BaseModelAPI, BaseModelFormView
-from .openai_requests import request_new_entry
-from .serializers import FullEntrySerializer, CreateEntrySerializer
-from .models import Entry
-from .tasks import hyperlink_entry
+from rest_framework.renderers import JSONRenderer
+from backend.base_views import BaseModelAPI, BaseModelCSVUploadView, BaseModelFormView
+from .serializers import FullEntrySerializer, CreateEntrySerializer, EntryLinkSerializer
+from .models import Entry, EntryLink
+from .generation import get_cached_response
+from .linker import get_corpus_version
+from .search import get_search_backend, suggest_titles
+from .tasks import queue_entry_batch, queue_entry_request
+from .utils import read_topics
 
 import logging
 logger = logging.getLogger("django")
@@ -20,6 +23,9 @@ class EntryBase:
     model = Entry
     serializer_class = FullEntrySerializer
 
+    def get_queryset(self):
+        return super().get_queryset().with_tags()
+
 class CreateEntry(EntryBase, BaseModelAPI):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
@@ -31,6 +37,48 @@ class CreateEntry(EntryBase, BaseModelAPI):
 class ViewEntry(EntryBase, BaseModelAPI):
     pass
 
+class EntryLinkList(EntryBase, BaseModelAPI):
+    """
+    Lists the links recorded for an entry, in the direction given by link_field.
+    Links are only recorded when they are stored in descriptions, so this is not available
+    when ENTRY_LINK_MODE is 'render'.
+    """
+    serializer_class = EntryLinkSerializer
+    link_field = None
+    link_ordering = None
+
+    def get(self, request, *args, **kwargs):
+        if settings.ENTRY_LINK_MODE != 'stored':
+            return Response(
+                {"message": "Links are only recorded when ENTRY_LINK_MODE is 'stored'", 'results': [], 'count': 0},
+                status=status.HTTP_501_NOT_IMPLEMENTED
+            )
+        slug = self.kwargs['slug']
+        if not Entry.objects.filter(slug=slug).exists():
+            return Response({"message": 'No results', 'results': [], 'count': 0}, status=status.HTTP_404_NOT_FOUND)
+        links = (
+            EntryLink.objects.filter(**{self.link_field: slug})
+            .select_related('source', 'target')
+            .only('anchor_text', 'source__slug', 'source__title', 'target__slug', 'target__title')
+            .order_by(self.link_ordering)
+        )
+        results = self.serializer_class(links, many=True).data
+        return Response({"message": 'Success', 'results': results, 'count': len(results)}, status=status.HTTP_200_OK)
+
+class EntryBacklinks(EntryLinkList):
+    """
+    List the entries that link to an entry.
+    """
+    link_field = 'target'
+    link_ordering = 'source__title'
+
+class EntryOutboundLinks(EntryLinkList):
+    """
+    List the entries that an entry links to.
+    """
+    link_field = 'source'
+    link_ordering = 'target__title'
+
 class UpdateEntry(EntryBase, BaseModelFormView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
@@ -39,94 +87,155 @@ class UpdateEntry(EntryBase, BaseModelFormView):
         return super().put(request, *args, **kwargs)
 
 class RequestNewEntry(EntryBase, BaseModelAPI):
+    """
+    Queues the generation of a new entry and responds straight away with the job id.
+    The user is notified over their websocket when the job finishes (see queue_entry_request).
+    If the content for the query is already cached, the job is run here and its result returned.
+    """
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        # 1) Immediately acknowledge
-        response = Response(status=status.HTTP_202_ACCEPTED)
-        # But continue processing on this same thread
-        self._handle_request(request)
-        return response
-
-    def _handle_request(self, request):
         self.querydict = self.get_querydict()
-        query = self.querydict['query'].lower()
-        # Websocket connection
-        channel_layer = get_channel_layer()
-        group_name = f"user_{request.user.slug}"
-
-        def notify(type_, message, **extra):
-            async_to_sync(channel_layer.group_send)(
-                group_name,
-                {
-                    "type": "send_notification",
-                    "message_type": type_,
-                    "message": message,
-                    **extra
-                }
-            )
+        query = self.querydict.get('query', '')
+        if get_cached_response(query) is not None:
+            job = queue_entry_request(query, request.user, eager=True).get()
+            response_status = status.HTTP_201_CREATED if job['status'] == 'created' else status.HTTP_200_OK
+            return Response({"message": job['message'], "job_id": job['job_id'], "results": job}, status=response_status)
+        result = queue_entry_request(query, request.user)
+        return Response({"message": "Accepted", "job_id": result.id}, status=status.HTTP_202_ACCEPTED)
 
-        if not query:
-            notify("error", "Missing query parameter")
-        elif len(query) > 50:
-            notify("error", "This query is too long")
-        else:
-            try:
-                entry = Entry.objects.get(slug=slugify(query))
-                if entry:
-                    notify("success", "Entry already exists", linkUrl=f"/entries/{slugify(query)}", linkLabel="View")
-            except Entry.DoesNotExist:
-                pass
-
-        response = request_new_entry(query)
-        with open(f"entries/files/{query}.txt", "w") as f:
-            f.write(response)
-
-        entry_data = {
-            "title": query,
-            "description": response,
-            "created_by": request.user.email,
-            "updated_by": request.user.email
-        }
-        serializer = CreateEntrySerializer(data=entry_data)
-        if serializer.is_valid():
-            serializer.save()
-            notify("success", f"Entry for {query} created successfully", linkUrl=f"/entries/{serializer.instance.slug}", linkLabel="View")
-            hyperlink_entry.delay(serializer.instance.pk)
-        else:
-            logger.error(f"{serializer.__class__.__name__} ERRORS: {serializer.errors}")
-            notify("error", "Something went wrong")
+class GenerateEntries(EntryBase, BaseModelCSVUploadView):
+    """
+    Queues the generation of entries for many topics at once (see queue_entry_batch), given as
+    a JSON list of topics, {"topics": [...]}, or as an uploaded CSV or JSONL file (see read_topics).
+    The user is notified once the whole batch has been generated and linked.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer]
+    required_fields = ['topic']
+    file_extensions = ('.csv', '.jsonl')
+
+    def post(self, request, *args, **kwargs):
+        if 'file' in request.FILES:
+            return super().post(request, *args, **kwargs)
+        topics = request.data.get('topics') if hasattr(request.data, 'get') else None
+        if not isinstance(topics, list):
+            return Response({"message": "Expected a list of topics or a .csv or .jsonl file"}, status=status.HTTP_400_BAD_REQUEST)
+        return self.queue_topics(topics)
+
+    def process_csv(self):
+        lines = (line.decode('utf-8-sig') for line in self.file)
+        return self.queue_topics(read_topics(lines, self.file.name))
+
+    def form_invalid(self, form):
+        return Response(
+            {"message": "Expected a .csv file with a topic column or a .jsonl file", "errors": form.errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    def queue_topics(self, topics):
+        result, batch = queue_entry_batch(topics, self.request.user)
+        return Response({
+            "message": "Accepted" if result else "Nothing to generate",
+            "batch_id": result.id if result else None,
+            "results": batch,
+            "count": len(batch['queued']),
+        }, status=status.HTTP_202_ACCEPTED if result else status.HTTP_200_OK)
+
+class EntrySuggest(EntryBase, BaseModelAPI):
+    """
+    Suggests up to k entry titles (default and most ENTRY_SUGGEST_LIMIT) completing the prefix q,
+    tolerating typos (see SearchBackend.suggest). Meant to be called on every keystroke of a search box.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('k', settings.ENTRY_SUGGEST_LIMIT))
+        except ValueError:
+            return Response({"message": "k must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        suggestions = [{'title': title, 'slug': slug} for title, slug in suggest_titles(prefix, max(limit, 1))]
+        response = Response({"message": 'Success', 'results': suggestions, 'count': len(suggestions)}, status=status.HTTP_200_OK)
+        response['Cache-Control'] = f"private, max-age={settings.ENTRY_SUGGEST_MAX_AGE}"
+        return response
 
 class EntryList(EntryBase, BaseModelAPI):
     """
     List all entries.
+        ?q=         search
+        ?tag=       only entries with the tag; with several, entries with all of them, or any with ?match=any
+        ?facets=1   respond with {"results", "facets"}, where facets counts the entries of the results per tag
     """
     permission_classes = [IsAuthenticated]
 
+    def pop_filter(self, key):
+        try:
+            values = self.querydict.getlist(key)
+        except AttributeError:
+            values = self.querydict.get(key) or []
+            values = values if isinstance(values, list) else [values]
+        self.querydict.pop(key, None)
+        return [value for value in values if value]
+
     def get_queryset(self):
         if not hasattr(self, 'querydict'):
             self.get_querydict()
-        if self.querydict:
-            if 'q' in self.querydict:
-                query = self.querydict.pop('q')
-                queryset = self.model.objects.filter(
-                    Q(description__icontains=query) | Q(title__icontains=query)
-                )
-            queryset = self.model.objects.filter(**self.querydict)
-        else:
-            queryset = self.model.objects.all()
+        self.search_query = (self.querydict.get('q') or '').strip()
+        self.querydict.pop('q', None)
+        self.tags = self.pop_filter('tag')
+        self.match_all = self.pop_filter('match') != ['any']
+        self.facets = bool(self.pop_filter('facets'))
+        queryset = self.model.objects.filter(**self.collapse_querydict_values(self.querydict))
+        if self.tags:
+            queryset = queryset.tagged(self.tags, match_all=self.match_all)
+        if self.search_query:
+            queryset = get_search_backend().search(queryset.only('slug', 'title', 'description'), self.search_query)
+        self.matches = queryset
+        if self.search_query:
+            queryset = queryset[:settings.ENTRY_SEARCH_LIMIT]
         return queryset
 
     def get(self, request):
         queryset = self.get_queryset()
-        entries = [{'title': entry.title, 'slug': entry.slug} for entry in queryset]
-        entries = json.dumps(entries)
-        request.session['entries'] = entries
+        if self.search_query:
+            results = list(queryset)
+            snippets = get_search_backend().snippets(results, self.search_query)
+            entries = [{'title': entry.title, 'slug': entry.slug, 'snippet': snippets.get(entry.slug, '')} for entry in results]
+        elif self.querydict or self.tags or self.facets:
+            entries = self.list_entries(queryset)
+        else:
+            return self.get_all_entries(request)
+        if self.facets:
+            return Response(
+                {"message": 'Success', 'results': entries, 'count': len(entries), 'facets': self.matches.tag_facets()},
+                status=status.HTTP_200_OK
+            )
         return Response(entries, status=status.HTTP_200_OK)
-        # if 'entries' not in request.session:
-        #     entries = list(self.get_queryset().values('title', 'slug')[:50])    
-        #     request.session['entries'] = entries
-        #     return Response(entries, status=status.HTTP_200_OK)
-        # else:
-        #     return Response(request.session['entries'], status=status.HTTP_200_OK)
\ No newline at end of file
+
+    def list_entries(self, queryset):
+        return [{'title': title, 'slug': slug} for title, slug in queryset.values_list('title', 'slug')]
+
+    def get_all_entries(self, request):
+        """
+        The unfiltered list only changes when an entry is created, renamed or deleted, so it is
+        cached per corpus version and the version is its ETag; a client that sends the ETag back
+        in If-None-Match gets a 304 without the list being read at all.
+        """
+        version = get_corpus_version()
+        if version is None:
+            return Response(self.list_entries(self.model.objects.all()), status=status.HTTP_200_OK)
+        etag = quote_etag(f"entries-{version}")
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            key = f"entries:list:{version}"
+            entries = cache.get(key)
+            if entries is None:
+                entries = self.list_entries(self.model.objects.all())
+                cache.set(key, entries, timeout=settings.ENTRY_LIST_CACHE_TIMEOUT)
+            response = Response(entries, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -103,6 +103,23 @@ export const api = {
     }
     return data;
   },
+  /**
+   * Suggest entry titles completing a prefix, for the search box
+   */
+  async suggestEntries(prefix: string, signal?: AbortSignal): Promise<{ title: string; slug: string }[]> {
+    const response = await fetch(`/api/entries/suggest/?q=${encodeURIComponent(prefix)}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+        ...getAuthHeaders()
+      },
+      credentials: 'include',
+      signal,
+    });
+    if (!response.ok) throw new Error('Failed to fetch suggestions');
+    const data = await response.json();
+    return data.results;
+  },
   /**
    * Search entries
    */
@@ -138,19 +155,26 @@ export const api = {
 
   /**
    * Request a new entry
-   * Does not return response. User will receive notification when request is fulfilled.
+   * User will receive notification when request is fulfilled.
+   * Resolves to the id of the job, whose content arrives as 'entry-stream' events while it is generated.
    */
-  requestNewEntry(entryData: string) {
-    fetch('/api/entries/request-new/', {
-      method: 'POST',
-      body: JSON.stringify({'query': entryData}),
-      headers: {
-        'Content-Type': 'application/json',
-        ...getAuthHeaders() 
-      },
-      credentials: 'include',
-    });
+  async requestNewEntry(entryData: string): Promise<string | null> {
     toast.info(`New entry for ${entryData} requested.`);
+    try {
+      const response = await fetch('/api/entries/request-new/', {
+        method: 'POST',
+        body: JSON.stringify({'query': entryData}),
+        headers: {
+          'Content-Type': 'application/json',
+          ...getAuthHeaders() 
+        },
+        credentials: 'include',
+      });
+      const data = await response.json();
+      return data.job_id || null;
+    } catch {
+      return null;
+    }
   },
   /**
    * Delete an entry
@@ -2,10 +2,12 @@ import React, { useState, useRef, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome';
 import { faMagnifyingGlass, faCircleXmark } from '@fortawesome/free-solid-svg-icons';
+import { api } from 'api';
 
 export default function Searchbar() {
   const [query, setQuery] = useState('');
   const [isVisible, setIsVisible] = useState(false);
+  const [suggestions, setSuggestions] = useState<{ title: string; slug: string }[]>([]);
   const searchInputRef = useRef<HTMLInputElement>(null);
   const navigate = useNavigate();
 
@@ -16,9 +18,33 @@ export default function Searchbar() {
     }
   }, [isVisible]);
 
+  // Suggest titles as the user types, waiting for a pause and dropping stale requests
+  useEffect(() => {
+    const prefix = query.trim();
+    if (!prefix) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    const timeout = setTimeout(() => {
+      api.suggestEntries(prefix, controller.signal)
+        .then(setSuggestions)
+        .catch(() => {});
+    }, 100);
+    return () => {
+      clearTimeout(timeout);
+      controller.abort();
+    };
+  }, [query]);
+
   const handleSearch = (event: React.FormEvent<HTMLFormElement>) => {
     event.preventDefault();
-    if (query.trim()) {
+    const match = suggestions.find((suggestion) => suggestion.title.toLowerCase() === query.trim().toLowerCase());
+    if (match) {
+      navigate(`/entries/${match.slug}/`);
+      setQuery('');
+      setIsVisible(false);
+    } else if (query.trim()) {
       navigate(`/entries/?q=${encodeURIComponent(query.trim())}`);
       setQuery('');
       setIsVisible(false);
@@ -48,7 +74,14 @@ export default function Searchbar() {
             placeholder="Search"
             value={query}
             onChange={(e) => setQuery(e.target.value)}
+            list="search-suggestions"
+            autoComplete="off"
           />
+          <datalist id="search-suggestions">
+            {suggestions.map((suggestion) => (
+              <option key={suggestion.slug} value={suggestion.title} />
+            ))}
+          </datalist>
         </form>
       )}
     </div>
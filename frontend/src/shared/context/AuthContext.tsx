@@ -72,6 +72,9 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
                 } else {
                   console.log('Notification:', data.message);
                 }
+              } else if (data.type === 'entry_stream') {
+                // Partial content of an entry being generated, for whichever view is showing the job
+                window.dispatchEvent(new CustomEvent('entry-stream', { detail: data }));
               } else {
                 console.warn("Received unknown message type:", data.type);
               }
@@ -1,19 +1,51 @@
 import Label from 'shared/components/Label';
 import Input from 'shared/components/Input';
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { api } from 'api';
 
+interface EntryStream {
+    content: string;
+    done: boolean;
+}
+
 export default function RequestNewEntryForm() {
     const [title, setTitle] = useState('');
-    const submitRequestNewEntryForm = (e: React.FormEvent) => {
+    const [jobId, setJobId] = useState<string | null>(null);
+    // Kept for every job, as content can arrive before the request returns the job id
+    const [streams, setStreams] = useState<Record<string, EntryStream>>({});
+
+    useEffect(() => {
+        // Re-dispatched by AuthContext from the notification websocket
+        const onEntryStream = (event: Event) => {
+            const { jobId, content, done } = (event as CustomEvent).detail;
+            setStreams((streams) => ({
+                ...streams,
+                [jobId]: { content: (streams[jobId]?.content || '') + content, done },
+            }));
+        };
+        window.addEventListener('entry-stream', onEntryStream);
+        return () => window.removeEventListener('entry-stream', onEntryStream);
+    }, []);
+
+    const submitRequestNewEntryForm = async (e: React.FormEvent) => {
         e.preventDefault();
-        api.requestNewEntry(title);
+        setJobId(null);
+        setJobId(await api.requestNewEntry(title));
     }
+    const stream = jobId ? streams[jobId] : undefined;
     return (
-        <form onSubmit={(e) => submitRequestNewEntryForm(e)}>
-            <Label htmlFor="title">Request New Entry for:</Label>
-            <Input id="title" name="title" type="text"value={title} onChange={(e) => setTitle(e.target.value)} disabled={false} />
-            <button type="submit">Submit</button>
-        </form>
+        <>
+            <form onSubmit={(e) => submitRequestNewEntryForm(e)}>
+                <Label htmlFor="title">Request New Entry for:</Label>
+                <Input id="title" name="title" type="text"value={title} onChange={(e) => setTitle(e.target.value)} disabled={false} />
+                <button type="submit">Submit</button>
+            </form>
+            {stream && (
+                <div className="entry-stream">
+                    <strong>{stream.done ? 'Generated, now saving:' : 'Generating...'}</strong>
+                    <div className="entry-stream-content">{stream.content}</div>
+                </div>
+            )}
+        </>
     );
-}
\ No newline at end of file
+}
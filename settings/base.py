@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     ## Installed ##
     'corsheaders',
     'rest_framework',
@@ -176,6 +177,54 @@ NEOMODEL_FORCE_TIMEZONE = False
 NEOMODEL_MAX_CONNECTION_POOL_SIZE = 50
 
 MAX_QUERYSET_SIZE = 1000
+TAG_BULK_LIMIT = 10000  # Most tags or entries in one request to the bulk tagging endpoints
+
+# Entry linking
+# 'stored': links are written into Entry.description when entries are created (hyperlink_entry).
+# 'render': descriptions are stored unlinked and links are injected when entries are serialized.
+#           This relies on a shared ENTRY_CORPUS_VERSION_CACHE, as the corpus version is kept there.
+#           Run index_entries after switching back to 'stored', as the term index is not kept in 'render' mode.
+#           The link graph (EntryLink) is not kept either, so the backlinks and links endpoints respond 501.
+ENTRY_LINK_MODE = 'stored'
+ENTRY_RENDER_CACHE_TIMEOUT = 60 * 60 * 24  # Rendered descriptions, per entry and corpus version
+# Alias of the cache holding the corpus version, which the title matcher, title trie and entry list are reused for.
+# It must keep values and be shared by every process, or they are rebuilt on every request.
+ENTRY_CORPUS_VERSION_CACHE = 'default'
+ENTRY_LINK_BATCH_WINDOW = 5  # Seconds during which new entries are gathered into one linking pass
+ENTRY_LINK_BATCH_SIZE = 100  # Most entries linked in one pass
+ENTRY_REQUEST_FLIGHT_TIMEOUT = 60 * 5  # Longest a request for an entry can hold off other requests for it
+ENTRY_STREAM_FRAME_INTERVAL = 0.1  # Least seconds between entry_stream events sent while an entry is generated
+ENTRY_BATCH_CONCURRENCY = 4  # Entries of a batch generated at once; the provider's rate limits still apply
+ENTRY_SEARCH_BACKEND = 'entries.search.PostgresSearchBackend'  # InvertedIndexSearchBackend or DatabaseSearchBackend work on any database
+ENTRY_SEARCH_CONFIG = 'english'  # PostgreSQL text search configuration
+ENTRY_SEARCH_INDEX_PATH = BASE_DIR / 'cache' / 'search_index.bin'  # Snapshot of the InvertedIndexSearchBackend index
+ENTRY_SEARCH_INDEX_LAG = 60  # Seconds before the newest indexed entry that InvertedIndexSearchBackend re-checks for late commits
+ENTRY_SEARCH_LIMIT = 50  # Most results returned for a search
+ENTRY_LIST_CACHE_TIMEOUT = 60 * 60 * 24  # The list of every entry, per corpus version
+ENTRY_SUGGEST_LIMIT = 10  # Most titles suggested for a prefix
+ENTRY_SUGGEST_TYPO_LENGTH = 4  # Shortest prefix that TitleTrie matches with a typo
+ENTRY_SUGGEST_CACHE_TIMEOUT = 60 * 60  # Suggestions per prefix, until the set of titles changes
+ENTRY_SUGGEST_MAX_AGE = 60  # Seconds browsers may reuse a response from the suggest endpoint
+
+# Generation of new entries (see entries.generation). LocalGenerationBackend needs no API key and is
+# configured with ENTRY_LOCAL_GENERATION, for load testing and CI
+ENTRY_GENERATION_BACKEND = 'entries.openai_requests.OpenAIGenerationBackend'
+ENTRY_LOCAL_GENERATION = {
+    'SIZE': 4000,  # Least characters of content
+    'LATENCY': 0.5,  # Seconds before the first piece of content
+    'CHUNK_SIZE': 20,  # Characters in each streamed piece
+    'CHUNK_INTERVAL': 0.02,  # Seconds between pieces
+}
+
+# OpenAI requests (see entries.openai_requests). OPENAI_API_KEY and OPENAI_MODEL_NAME are set per environment
+OPENAI_BASE_URL = None  # Any OpenAI-compatible API, e.g. a local server; None for the OpenAI API
+OPENAI_TIMEOUT = 120  # Seconds
+OPENAI_REQUESTS_PER_MINUTE = 60  # Shared by every worker; None or 0 for no limit
+OPENAI_TOKENS_PER_MINUTE = 150000  # Shared by every worker; None or 0 for no limit
+OPENAI_ESTIMATED_COMPLETION_TOKENS = 1500  # Reserved for each response until its usage is known
+OPENAI_MAX_RETRIES = 5
+OPENAI_BACKOFF_BASE = 1  # Seconds; doubled on each retry, up to OPENAI_BACKOFF_MAX, with full jitter
+OPENAI_BACKOFF_MAX = 30
 
 AUTHENTICATION_BACKENDS = [
     # Needed to login by username in Django admin, regardless of `allauth`
@@ -296,8 +345,18 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.db.DatabaseCache",
         "LOCATION": "cache_table",
-    }
+    },
+    # Generated entry content, keyed by model, system prompt and query (see entries.openai_requests)
+    "llm_responses": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache", "llm_responses"),
+        "TIMEOUT": 60 * 60 * 24 * 30,
+        "OPTIONS": {
+            "MAX_ENTRIES": 5000,  # Oldest responses are culled beyond this
+        },
+    },
 }
+ENTRY_RESPONSE_CACHE = "llm_responses"  # Alias of the cache for generated content, or None to not cache it
 
 # # Celery Settings
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
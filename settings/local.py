@@ -15,6 +15,8 @@ SECRET_KEY=env("SECRET_KEY")
 
 OPENAI_API_KEY = env("OPENAI_API_KEY")
 OPENAI_MODEL_NAME = env("OPENAI_API_MODEL")
+ENTRY_GENERATION_BACKEND = env("ENTRY_GENERATION_BACKEND", default=ENTRY_GENERATION_BACKEND)
+ENTRY_SEARCH_BACKEND = env("ENTRY_SEARCH_BACKEND", default=ENTRY_SEARCH_BACKEND)
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'http://localhost:8000/', ]
 BASE_URL = 'http://127.0.0.1:8000'
@@ -37,8 +39,16 @@ STATIC_ROOT = 'staticfiles'
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-    }
+    },
+    'llm_responses': CACHES['llm_responses'],  # Kept so that repeated queries in development aren't paid for again
+    # Kept in files shared by the server and workers, so that what is built per corpus version is reused
+    'corpus_version': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'corpus_version'),
+        'TIMEOUT': None,
+    },
 }
+ENTRY_CORPUS_VERSION_CACHE = 'corpus_version'
 
 ACCOUNT_EMAIL_VERIFICATION = 'mandatory'  # Options: 'mandatory', 'optional', 'none'
 
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class TagsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tags'
+
+    def ready(self):
+        from .signals import count_tagged_item, uncount_tagged_item
+        TaggedItem = self.get_model('TaggedItem')
+        post_save.connect(count_tagged_item, sender=TaggedItem)
+        post_delete.connect(uncount_tagged_item, sender=TaggedItem)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from tags.models import Tag
+
+
+class Command(BaseCommand):
+    help = "Recounts the tagged items of every tag, correcting any Tag.usage_count that has drifted."
+
+    def handle(self, *args, **options):
+        corrected = Tag.objects.update_usage_counts()
+        self.stdout.write(self.style.SUCCESS(f"Corrected the usage count of {corrected} tags"))
@@ -1,6 +1,13 @@
-from django.db import models
+import hashlib
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.utils.text import slugify
-from backend.base_models import PrimaryObjectModel, SecondaryObjectModel
+from backend.base_models import PrimaryObjectModel, SecondaryObjectModel, SecondaryObjectModelManager, SecondaryObjectQuerySet
 from colorfield.fields import ColorField
 
 """
@@ -16,7 +23,14 @@ Rules:
 """
 
 
-class TagManager(models.Manager):
+class TagNameConflict(ValueError):
+    """
+    Raised when distinct tag names would share a slug, e.g. 'C' and 'C++'.
+    """
+    pass
+
+
+class TagManager(SecondaryObjectModelManager):
     def get_or_create(self, **kwargs):
         if 'name' not in kwargs:
             raise KeyError(f'get_or_create method is dependent on a tag name, not {kwargs}')
@@ -27,6 +41,78 @@ class TagManager(models.Manager):
             tag.save()
         return tag
 
+    def bulk_get_or_create(self, names, user):
+        """
+        Returns the tags with the given names, creating those that don't exist, in two statements in
+        one transaction: an INSERT that skips the slugs that already exist, and a SELECT. Unlike get_or_create,
+        concurrent calls can't fail or create a tag twice.
+        Names that differ only in case and spacing are the same tag. Names that differ otherwise but
+        share a slug, with each other or with an existing tag, raise TagNameConflict and nothing is created.
+        Tags aren't attached to an object, so new tags point at themselves through model and instance_slug.
+        """
+        name_length = self.model._meta.get_field('name').max_length
+        slug_length = self.model._meta.get_field('slug').max_length
+        new_tags = {}
+        conflicts = []
+        for name in names:
+            name = " ".join(str(name).split())[:name_length]
+            slug = slugify(name)[:slug_length]
+            if slug and new_tags.setdefault(slug, name).casefold() != name.casefold():
+                conflicts.append((new_tags[slug], name, slug))
+        if conflicts:
+            raise TagNameConflict(self.describe_conflicts(conflicts))
+        if not new_tags:
+            return []
+        content_type = ContentType.objects.get_for_model(self.model)
+        with transaction.atomic(using=self.db):
+            self.bulk_create(
+                [
+                    self.model(slug=slug, name=name, model=content_type, instance_slug=slug, created_by=user, updated_by=user)
+                    for slug, name in new_tags.items()
+                ],
+                ignore_conflicts=True,
+            )
+            tags = list(self.filter(slug__in=new_tags))
+            conflicts = [(tag.name, new_tags[tag.slug], tag.slug) for tag in tags if tag.name.casefold() != new_tags[tag.slug].casefold()]
+            if conflicts:
+                raise TagNameConflict(self.describe_conflicts(conflicts))
+        return tags
+
+    @staticmethod
+    def describe_conflicts(conflicts):
+        return "Tag names must have distinct slugs: " + ", ".join(
+            f"'{name}' and '{other_name}' are both '{slug}'" for name, other_name, slug in conflicts
+        )
+
+    def popular(self, limit=None):
+        """
+        The visible tags in use, most used first, read from the usage_count index.
+        """
+        tags = self.filter(hidden=False, usage_count__gt=0).order_by('-usage_count', 'name')
+        return tags[:limit] if limit else tags
+
+    def change_usage_count(self, tag_id, change):
+        """
+        Adds change to the tag's usage_count. A count that has drifted low is floored at zero
+        rather than left as it was (see reconcile_tag_counts).
+        """
+        if change:
+            self.filter(pk=tag_id).update(usage_count=Greatest(F('usage_count') + change, 0))
+
+    def update_usage_counts(self, tag_ids=None):
+        """
+        Recounts the tagged items of the given tags, or of every tag, in one UPDATE, and returns
+        the number of tags whose usage_count was wrong.
+        """
+        counts = Coalesce(
+            Subquery(
+                TaggedItem.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(count=Count('pk')).values('count')
+            ),
+            0,
+        )
+        tags = self.all() if tag_ids is None else self.filter(pk__in=tag_ids)
+        return tags.exclude(usage_count=counts).update(usage_count=counts)
+
 class Tag(SecondaryObjectModel):
     class Meta:
         app_label = 'tags'
@@ -37,12 +123,15 @@ class Tag(SecondaryObjectModel):
         ordering = ['slug']
         indexes = [
             models.Index(fields=['name', ]),
+            models.Index(fields=['-usage_count', 'name'], name='tag_usage_count'),
         ]
         abstract = False
 
     name = models.CharField(max_length=50, null=False, blank=False)
     colour = ColorField(default='#FFF')
     hidden = models.BooleanField(default=False, verbose_name='Hidden', null=False, blank=False)
+    # The number of tagged items, kept by the TaggedItem signals and queryset; see reconcile_tag_counts
+    usage_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Usage Count')
     # Slug
     slug = models.SlugField(primary_key=True)
 
@@ -53,16 +142,109 @@ class Tag(SecondaryObjectModel):
 
     @property
     def taggeditems_count(self):
-        if not hasattr(self, '_taggeditems_count'): # TODO cache
-            self._taggeditems_count = self.taggeditems.all().count()
-        return self._taggeditems_count
+        return self.usage_count
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)[:100]
         super(Tag, self).save(*args, **kwargs)
 
-class TaggedItemManager(models.Manager):
+class TaggedItemQuerySet(SecondaryObjectQuerySet):
+    """
+    Bulk operations skip the signals that keep Tag.usage_count, so they recount the tags they touch.
+    """
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Tag.objects.update_usage_counts({obj.tag_id for obj in objs})
+        return objs
+
+    def update(self, **kwargs):
+        if 'tag' not in kwargs and 'tag_id' not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            tag_ids = set(self.order_by().values_list('tag', flat=True).distinct())
+            updated = super().update(**kwargs)
+            tag = kwargs.get('tag', kwargs.get('tag_id'))
+            Tag.objects.update_usage_counts(tag_ids | {getattr(tag, 'pk', tag)})
+        return updated
+
+    def delete(self):
+        """
+        Nothing depends on tagged items, so they are deleted in one statement rather than
+        one by one through the signals, and their tags are decremented per tag.
+        """
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        with transaction.atomic(using=self.db):
+            counts = self.order_by().values_list('tag').annotate(count=Count('pk'))
+            for tag_id, count in counts:
+                Tag.objects.change_usage_count(tag_id, -count)
+            deleted = self._raw_delete(self.db)
+        return deleted, {self.model._meta.label: deleted}
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+class TaggedItemManager(SecondaryObjectModelManager.from_queryset(TaggedItemQuerySet)):
+    def bulk_tag(self, items, tags, user):
+        """
+        Tags each of the items, PrimaryObjectModel instances or a queryset of them, with each of the
+        tags, Tag instances or names of tags to get or create. Items already tagged are skipped by
+        the unique constraints, so tagging thousands of items takes a few statements rather than
+        a query or two per item. Returns the number of tagged items created.
+        """
+        tags = list(tags)
+        tags = [tag for tag in tags if isinstance(tag, Tag)] + Tag.objects.bulk_get_or_create([tag for tag in tags if not isinstance(tag, Tag)], user)
+        if isinstance(items, models.QuerySet):
+            content_type = ContentType.objects.get_for_model(items.model)
+            targets = [(content_type, slug) for slug in items.values_list('slug', flat=True)]
+        else:
+            targets = [(ContentType.objects.get_for_model(item), item.slug) for item in items]
+        slug_length = self.model._meta.get_field('slug').max_length
+        tagged_items = [
+            self.model(
+                tag=tag, model=content_type, instance_slug=instance_slug, tagged_by=user, created_by=user, updated_by=user,
+                slug=slugify(f"{tag} {instance_slug}")[:slug_length],
+            )
+            for content_type, instance_slug in targets for tag in tags
+        ]
+        if not tagged_items:
+            return 0
+        self.make_slugs_unique(tagged_items)
+        instance_slugs = defaultdict(set)
+        for content_type, instance_slug in targets:
+            instance_slugs[content_type].add(instance_slug)
+        # The conflicts skipped aren't reported, so the items are counted before and after
+        existing = self.filter(tag__in=tags).filter(
+            reduce(or_, (Q(model=content_type, instance_slug__in=slugs) for content_type, slugs in instance_slugs.items()))
+        )
+        with transaction.atomic(using=self.db):
+            existing_count = existing.count()
+            self.bulk_create(tagged_items, ignore_conflicts=True)
+            return existing.count() - existing_count
+
+    def make_slugs_unique(self, tagged_items):
+        """
+        A tagged item's slug joins its tag and instance slug, so distinct tagged items can share one:
+        the tag 'Event' on 'sourcing-kafka' and the tag 'Event Sourcing' on 'kafka' are both
+        'event-sourcing-kafka'. Rather than be skipped as a conflict, an item whose slug belongs to
+        another tagged item, stored or earlier in the list, gets a suffix hashed from its tag, model and instance slug.
+        """
+        slug_length = self.model._meta.get_field('slug').max_length
+        owners = {
+            slug: (tag_id, model_id, instance_slug)
+            for slug, tag_id, model_id, instance_slug in self.filter(
+                slug__in={tagged_item.slug for tagged_item in tagged_items}
+            ).values_list('slug', 'tag', 'model', 'instance_slug')
+        }
+        for tagged_item in tagged_items:
+            owner = (tagged_item.tag_id, tagged_item.model_id, tagged_item.instance_slug)
+            if owners.setdefault(tagged_item.slug, owner) != owner:
+                suffix = hashlib.sha256(repr(owner).encode()).hexdigest()[:8]
+                tagged_item.slug = f"{tagged_item.slug[:slug_length - len(suffix) - 1]}-{suffix}"
+                owners.setdefault(tagged_item.slug, owner)
+
     def get_or_create(self, **kwargs):
         try:
             get_kwargs = ['tag', 'model', 'instance_slug']
@@ -90,6 +272,13 @@ class TaggedItem(SecondaryObjectModel):
     def __str__(self):
         return f"{self.tag} - {self.instance_slug}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Kept so that a change of tag can be counted on save
+        instance._loaded_tag_id = instance.__dict__.get('tag_id')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(f"{self.tag} {self.instance_slug}")[:200]
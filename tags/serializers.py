@@ -0,0 +1,7 @@
+from rest_framework import serializers
+from .models import Tag
+
+class TagSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ('slug', 'name', 'colour', 'usage_count')
@@ -0,0 +1,19 @@
+from .models import Tag
+
+
+def count_tagged_item(sender, instance, created, raw=False, **kwargs):
+    """
+    Adds a new tagged item to its tag's usage_count, or moves it between tags when its tag changed.
+    """
+    if raw:
+        return
+    loaded_tag_id = getattr(instance, '_loaded_tag_id', None)
+    if created:
+        Tag.objects.change_usage_count(instance.tag_id, 1)
+    elif loaded_tag_id is not None and loaded_tag_id != instance.tag_id:
+        Tag.objects.change_usage_count(loaded_tag_id, -1)
+        Tag.objects.change_usage_count(instance.tag_id, 1)
+    instance._loaded_tag_id = instance.tag_id
+
+def uncount_tagged_item(sender, instance, **kwargs):
+    Tag.objects.change_usage_count(instance.tag_id, -1)
@@ -1,3 +1,227 @@
-from django.test import TestCase
+from io import StringIO
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.text import slugify
+from rest_framework.test import APIClient
+from entries.models import Entry
+from users.models import BaseUser
 
-# Create your tests here.
+from .models import Tag, TaggedItem, TagNameConflict
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TagTestCase(TestCase):
+    """
+    Entries and tags created by a test user.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = BaseUser.objects.create_user(email="tester@example.com", username="tester", password="password")
+        for title in ("Kafka", "Redis", "Flink"):
+            Entry.objects.create(title=title, description=f"<p>{title}.</p>", created_by=cls.user, updated_by=cls.user)
+        cls.streaming, cls.storage = cls.create_tag("Streaming"), cls.create_tag("Storage")
+
+    @classmethod
+    def create_tag(cls, name):
+        return Tag.objects.create(
+            name=name, slug=slugify(name), model=ContentType.objects.get_for_model(Tag), instance_slug=slugify(name),
+            created_by=cls.user, updated_by=cls.user
+        )
+
+    @classmethod
+    def tag_entries(cls, slugs, tags):
+        """
+        Tags the entries in one bulk_create, which recounts the tags rather than sending the TaggedItem signals.
+        """
+        content_type = ContentType.objects.get_for_model(Entry)
+        TaggedItem.objects.bulk_create([
+            TaggedItem(
+                tag=tag, model=content_type, instance_slug=slug, slug=slugify(f"{tag} {slug}"),
+                tagged_by=cls.user, created_by=cls.user, updated_by=cls.user
+            )
+            for slug in slugs for tag in tags
+        ])
+
+    def tag(self, tag, slug):
+        return TaggedItem.objects.create(
+            tag=tag, model=ContentType.objects.get_for_model(Entry), instance_slug=slug,
+            tagged_by=self.user, created_by=self.user, updated_by=self.user
+        )
+
+    def usage_counts(self):
+        return dict(Tag.objects.values_list("slug", "usage_count"))
+
+
+class UsageCountTests(TagTestCase):
+    def test_save_and_delete(self):
+        kafka = self.tag(self.streaming, "kafka")
+        self.tag(self.streaming, "flink")
+        self.assertEqual(self.usage_counts(), {"streaming": 2, "storage": 0})
+        kafka = TaggedItem.objects.get(pk=kafka.pk)
+        kafka.tag = self.storage
+        kafka.save()
+        self.assertEqual(self.usage_counts(), {"streaming": 1, "storage": 1})
+        kafka.save()
+        self.assertEqual(self.usage_counts(), {"streaming": 1, "storage": 1})
+        kafka.delete()
+        self.assertEqual(self.usage_counts(), {"streaming": 1, "storage": 0})
+
+    def test_queryset_update_and_delete(self):
+        self.tag_entries(["kafka", "redis", "flink"], [self.streaming])
+        self.assertEqual(self.usage_counts(), {"streaming": 3, "storage": 0})
+        self.assertEqual(TaggedItem.objects.filter(instance_slug__in=["kafka", "redis"]).update(tag=self.storage), 2)
+        self.assertEqual(self.usage_counts(), {"streaming": 1, "storage": 2})
+        self.assertEqual(TaggedItem.objects.filter(instance_slug="kafka").delete(), (1, {"tags.TaggedItem": 1}))
+        self.assertEqual(self.usage_counts(), {"streaming": 1, "storage": 1})
+        Entry.objects.get(slug="redis").delete()  # Deletes its tagged items through the GenericRelation
+        self.assertEqual(self.usage_counts(), {"streaming": 1, "storage": 0})
+        self.streaming.delete()
+        self.assertEqual(self.usage_counts(), {"storage": 0})
+        self.assertFalse(TaggedItem.objects.exists())
+
+    def test_drifted_counts_are_floored(self):
+        self.tag(self.streaming, "kafka")
+        self.tag(self.streaming, "flink")
+        Tag.objects.filter(pk="streaming").update(usage_count=1)
+        TaggedItem.objects.all().delete()
+        self.assertEqual(self.usage_counts(), {"streaming": 0, "storage": 0})
+
+    def test_reconcile(self):
+        self.tag_entries(["kafka", "redis", "flink"], [self.streaming, self.storage])
+        Tag.objects.filter(pk="streaming").update(usage_count=7)
+        Tag.objects.filter(pk="storage").update(usage_count=0)
+        output = StringIO()
+        with self.assertNumQueries(1):
+            call_command("reconcile_tag_counts", stdout=output)
+        self.assertIn("Corrected the usage count of 2 tags", output.getvalue())
+        self.assertEqual(self.usage_counts(), {"streaming": 3, "storage": 3})
+        self.assertEqual(Tag.objects.update_usage_counts(), 0)
+        self.assertEqual(list(Tag.objects.popular(1)), [self.storage])
+
+
+class TaggedTests(TagTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        internal = cls.create_tag("Internal")
+        Tag.objects.filter(pk=internal.pk).update(hidden=True)
+        cls.tag_entries(["kafka", "flink"], [cls.streaming])
+        cls.tag_entries(["kafka", "redis"], [cls.storage, internal])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tagged(self, tags, **kwargs):
+        return set(Entry.objects.tagged(tags, **kwargs).values_list("slug", flat=True))
+
+    def test_tagged(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.tagged(["streaming"]), {"kafka", "flink"})
+        self.assertEqual(self.tagged(["streaming", "storage"]), {"kafka"})
+        self.assertEqual(self.tagged(["streaming", "storage"], match_all=False), {"kafka", "flink", "redis"})
+        self.assertEqual(self.tagged(["streaming", "missing"]), set())
+        self.assertEqual(self.tagged([]), {"kafka", "flink", "redis"})
+
+    def test_tag_facets(self):
+        with self.assertNumQueries(1):
+            facets = Entry.objects.all().tag_facets()
+        self.assertEqual(facets, [
+            {"tag": "storage", "name": "Storage", "count": 2}, {"tag": "streaming", "name": "Streaming", "count": 2},
+        ])
+        self.assertEqual(Entry.objects.filter(slug="flink").tag_facets(), [{"tag": "streaming", "name": "Streaming", "count": 1}])
+        self.assertEqual(Entry.objects.tagged(["streaming"]).tag_facets()[0], {"tag": "streaming", "name": "Streaming", "count": 2})
+
+    def test_entry_list(self):
+        response = self.client.get("/api/entries/", {"tag": ["streaming", "storage"]})
+        self.assertEqual([entry["slug"] for entry in response.json()], ["kafka"])
+        response = self.client.get("/api/entries/", {"tag": ["streaming", "storage"], "match": "any"})
+        self.assertEqual([entry["slug"] for entry in response.json()], ["flink", "kafka", "redis"])
+        response = self.client.get("/api/entries/", {"tag": "streaming", "facets": "1"})
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual([facet["tag"] for facet in response.json()["facets"]], ["streaming", "storage"])
+
+
+class BulkTaggingTests(TagTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_get_or_create(self):
+        with self.assertNumQueries(4):  # An INSERT and a SELECT, in a savepoint
+            tags = Tag.objects.bulk_get_or_create(["Event  Sourcing", "streaming", "event sourcing", "!!"], self.user)
+        self.assertEqual([(tag.slug, tag.name) for tag in tags], [("event-sourcing", "Event Sourcing"), ("streaming", "Streaming")])
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertEqual(Tag.objects.bulk_get_or_create([], self.user), [])
+
+    def test_bulk_tag(self):
+        self.assertEqual(TaggedItem.objects.bulk_tag(Entry.objects.filter(slug__in=["kafka", "flink"]), [self.streaming], self.user), 2)
+        entries = list(Entry.objects.all())
+        self.assertEqual(TaggedItem.objects.bulk_tag(entries, [self.streaming, "Logs"], self.user), 4)
+        self.assertEqual(TaggedItem.objects.bulk_tag(entries, ["logs"], self.user), 0)
+        self.assertEqual(self.usage_counts(), {"streaming": 3, "storage": 0, "logs": 3})
+        self.assertEqual(TaggedItem.objects.bulk_tag(Entry.objects.none(), ["logs"], self.user), 0)
+
+    def test_tag_entries_endpoint(self):
+        data = {"tags": ["Streaming", "Logs"], "entries": ["kafka", "flink", "missing"]}
+        response = self.client.post("/api/tags/entries/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual({tag["slug"]: tag["usage_count"] for tag in response.data["results"]}, {"streaming": 2, "logs": 2})
+        data["entries"].append("redis")
+        self.assertEqual(self.client.post("/api/tags/entries/", data, format="json").data["count"], 2)
+        response = self.client.delete("/api/tags/entries/", {"tags": ["logs"], "entries": ["kafka", "redis"]}, format="json")
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(self.usage_counts(), {"streaming": 3, "storage": 0, "logs": 1})
+
+    def test_tag_list_endpoint(self):
+        response = self.client.post("/api/tags/", {"names": ["Logs", "streaming"]}, format="json")
+        self.assertEqual([tag["slug"] for tag in response.data["results"]], ["logs", "streaming"])
+        TaggedItem.objects.bulk_tag(Entry.objects.all(), [self.streaming], self.user)
+        TaggedItem.objects.bulk_tag(Entry.objects.filter(slug="kafka"), [self.storage], self.user)
+        response = self.client.get("/api/tags/", {"k": 1})
+        self.assertEqual([(tag["slug"], tag["usage_count"]) for tag in response.data["results"]], [("streaming", 3)])
+
+    @override_settings(TAG_BULK_LIMIT=2)
+    def test_invalid_requests(self):
+        for url, data in [
+            ("/api/tags/", {"names": "Logs"}),
+            ("/api/tags/", {"names": []}),
+            ("/api/tags/", {"names": ["Logs", "Streaming", "Storage"]}),
+            ("/api/tags/entries/", {"tags": ["logs"], "entries": [1]}),
+            ("/api/tags/entries/", {"tags": ["logs"]}),
+            ("/api/tags/", {"names": ["C", "C++"]}),
+            ("/api/tags/entries/", {"tags": ["C", "C++"], "entries": ["kafka"]}),
+        ]:
+            with self.subTest(url=url, data=data):
+                self.assertEqual(self.client.post(url, data, format="json").status_code, 400)
+        self.assertEqual(self.client.get("/api/tags/", {"k": "many"}).status_code, 400)
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_colliding_names_are_rejected(self):
+        with self.assertRaisesMessage(TagNameConflict, "'C' and 'C++' are both 'c'"):
+            Tag.objects.bulk_get_or_create(["C", "Logs", "C++"], self.user)
+        self.assertEqual(Tag.objects.count(), 2)
+        c = Tag.objects.bulk_get_or_create(["C"], self.user)[0]
+        with self.assertRaisesMessage(TagNameConflict, "'C' and 'C++' are both 'c'"):
+            Tag.objects.bulk_get_or_create(["Logs", "C++"], self.user)
+        with self.assertRaises(TagNameConflict):
+            TaggedItem.objects.bulk_tag(Entry.objects.all(), ["C++"], self.user)
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertFalse(TaggedItem.objects.exists())
+        self.assertEqual(Tag.objects.bulk_get_or_create([" c "], self.user), [c])
+
+    def test_colliding_slugs_are_tagged(self):
+        Entry.objects.create(title="Sourcing Kafka", description="<p>Sourcing Kafka.</p>", created_by=self.user, updated_by=self.user)
+        event, event_sourcing = Tag.objects.bulk_get_or_create(["Event", "Event Sourcing"], self.user)
+        self.assertEqual(TaggedItem.objects.bulk_tag(Entry.objects.filter(slug="sourcing-kafka"), [event], self.user), 1)
+        # The tag Event Sourcing on kafka has the same slug, event-sourcing-kafka
+        self.assertEqual(TaggedItem.objects.bulk_tag(Entry.objects.filter(slug__in=["kafka", "sourcing-kafka"]), [event, event_sourcing], self.user), 3)
+        self.assertEqual(TaggedItem.objects.bulk_tag(Entry.objects.all(), [event, event_sourcing], self.user), 4)
+        self.assertEqual(TaggedItem.objects.bulk_tag(Entry.objects.all(), [event, event_sourcing], self.user), 0)
+        self.assertEqual(TaggedItem.objects.filter(tag__in=[event, event_sourcing]).values("slug").distinct().count(), 8)
+        self.assertEqual(
+            set(Entry.objects.tagged(["event-sourcing"]).values_list("slug", flat=True)),
+            {"kafka", "redis", "flink", "sourcing-kafka"}
+        )
@@ -0,0 +1,11 @@
+from django.urls import path
+from .views import TagList, TagEntries
+
+urlpatterns = []
+
+api_urlpatterns = [
+    path('api/tags/', TagList.as_view(), name='api tags'),
+    path('api/tags/entries/', TagEntries.as_view(), name='api tags entries'),
+]
+
+urlpatterns += api_urlpatterns
@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from backend.base_views import BaseModelAPI
+from entries.models import Entry
+from .models import Tag, TaggedItem, TagNameConflict
+from .serializers import TagSerializer
+
+import logging
+logger = logging.getLogger("django")
+
+class TagBase:
+    model = Tag
+    serializer_class = TagSerializer
+
+    def get_list(self, key):
+        """
+        Returns the list of strings in the request data under key, or None if there isn't one of at most TAG_BULK_LIMIT.
+        """
+        values = self.request.data.get(key)
+        if not isinstance(values, list) or not 0 < len(values) <= settings.TAG_BULK_LIMIT:
+            return None
+        if not all(isinstance(value, str) for value in values):
+            return None
+        return values
+
+class TagList(TagBase, BaseModelAPI):
+    """
+    GET     api/tags/?k={limit}         the most used visible tags, e.g. for a tag cloud
+    POST    api/tags/ {"names": [...]}  get or create tags by name
+    """
+    permission_classes = [IsAuthenticated]
+    cloud_size = 100  # Default number of tags listed
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get('k', self.cloud_size))
+        except ValueError:
+            return Response({"message": "k must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        results = self.serializer_class(Tag.objects.popular(min(max(limit, 1), settings.TAG_BULK_LIMIT)), many=True).data
+        return Response({"message": 'Success', 'results': results, 'count': len(results)}, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        names = self.get_list('names')
+        if names is None:
+            return Response({"message": f"Expected a list of up to {settings.TAG_BULK_LIMIT} names"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            tags = Tag.objects.bulk_get_or_create(names, request.user)
+        except TagNameConflict as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        results = self.serializer_class(tags, many=True).data
+        return Response({"message": 'Success', 'results': results, 'count': len(results)}, status=status.HTTP_200_OK)
+
+class TagEntries(TagBase, BaseModelAPI):
+    """
+    POST    api/tags/entries/ {"tags": [...], "entries": [...]}     tag every entry with every tag, creating tags by name as needed
+    DELETE  api/tags/entries/ {"tags": [...], "entries": [...]}     remove the tags (by slug) from the entries
+    'count' is the number of tagged items created or deleted; entries that already had a tag aren't counted.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_tags_and_entries(self):
+        tags, entries = self.get_list('tags'), self.get_list('entries')
+        if tags is None or entries is None:
+            return None, None, Response(
+                {"message": f"Expected lists of up to {settings.TAG_BULK_LIMIT} tags and entries"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return tags, entries, None
+
+    def post(self, request, *args, **kwargs):
+        tags, entries, error = self.get_tags_and_entries()
+        if error:
+            return error
+        try:
+            tags = Tag.objects.bulk_get_or_create(tags, request.user)
+        except TagNameConflict as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        created = TaggedItem.objects.bulk_tag(Entry.objects.filter(slug__in=entries), tags, request.user)
+        # Read again for their new usage counts
+        results = self.serializer_class(Tag.objects.filter(slug__in=[tag.slug for tag in tags]), many=True).data
+        logger.info(f"[TagEntries] {request.user} tagged {len(entries)} entries with {len(tags)} tags: {created} new tagged items")
+        return Response({"message": 'Success', 'results': results, 'count': created}, status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        tags, entries, error = self.get_tags_and_entries()
+        if error:
+            return error
+        deleted, _ = TaggedItem.objects.filter(
+            model=ContentType.objects.get_for_model(Entry), instance_slug__in=entries, tag__in=tags
+        ).delete()
+        return Response({"message": 'Success', 'results': [], 'count': deleted}, status=status.HTTP_200_OK)